@@ -1,16 +1,40 @@
 import hashlib
+import hmac
+import secrets
 import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from datetime import datetime, timedelta
-
-import mysql.connector
 from mysql.connector import Error
+import numpy as np
 import pandas as pd
+import pyarrow.parquet as pq
 import plotly.express as px
 import plotly.graph_objects as go
 from plotly.subplots import make_subplots
 import streamlit as st
 
+from sales_engine import (
+    BUDGET_MAX, BUDGET_MIN, BUDGET_STEP, CHART_MAX_BARS, CHART_MAX_PAYLOAD_BYTES,
+    DatasetExplorer, DatasetHandle, EXPLORER_PAGE_SIZES, EXPORT_CHUNK_ROWS, EXPORT_FORMATS,
+    FORECAST_ENGINES, FORECAST_HORIZONS, MAX_UPLOAD_BYTES, MAX_UPLOAD_MB, QUERY_BACKENDS,
+    REPORT_COLUMNS, SCENARIOS, SEUIL_STOCK_BAS, TOP_N, TRENDS_FIXTURE_DIR, WEATHER_MIN_POINTS,
+    _LRUCache, _dataset_path, _get_connection, _release_connection, acquire_dataset,
+    budget_lift, build_analytics_plan, build_product_report, bulk_load_ventes, cache_forecast,
+    cached_forecast, calendar_for, compact_frame, compute_baseline_forecast,
+    compute_time_series, dataset_columns, dataset_lineage, dataset_quality, deactivate_dataset,
+    detect_sales_columns, downsample_line, filter_index, forecast_lock, forecast_series,
+    get_pool_metrics, ingest_uploaded_file, iter_dataset_chunks, list_user_datasets,
+    load_quality_profile, load_trends, lttb_indices, normalize_product_columns,
+    product_source_columns, profile_dataset, quality_alerts, query_analytics_plan,
+    query_dashboard_rollup, query_product_report, query_sales_options, query_top_products,
+    refresh_trends, register_dataset, sales_rollup, scatter_render_mode,
+    schedule_forecast_precompute, simulate_budget_grid, store_quality_profile,
+    top_k_with_others, weather_by_day_zone, write_chunks_to_file, write_frame_to_file,
+)
+
 # Garantit l'accès au module components, même si Streamlit exécute le script depuis la racine
 _CURRENT_DIR = Path(__file__).resolve().parent
 _CANDIDATE_DIRS = [_CURRENT_DIR, _CURRENT_DIR / "src"]
@@ -21,15 +45,13 @@ for _dir in _CANDIDATE_DIRS:
 
 from components.animations import inject_animations
 
-DB_CONFIG = {
-    "host": "localhost",
-    "user": "root",
-    "password": "",  # Remplacez par votre mot de passe MySQL
-    "database": "smart_market",
-}
-
-MAX_UPLOAD_BYTES = 1_000_000_000  # 1 Go
-MAX_UPLOAD_MB = MAX_UPLOAD_BYTES // (1024 * 1024)
+PASSWORD_KDF_ITERATIONS = 310_000  # PBKDF2-SHA256 ; les hachages plus faibles sont mis à niveau à la connexion
+PASSWORD_SALT_BYTES = 16
+AUTH_WORKERS = 4  # vérifications de mots de passe menées en parallèle
+AUTH_TIMEOUT = 15.0  # secondes
+LOGIN_CACHE_TTL = 300  # secondes pendant lesquelles une connexion vérifiée évite hachage et requête
+LOGIN_CACHE_SIZE = 256
+LAST_LOGIN_FLUSH_SECONDS = 30  # délai maximal avant l'écriture groupée des users.last_login en file
 
 
 def _asset_or_remote(name: str, remote_url: str):
@@ -111,6 +133,8 @@ def create_menu():
                     if st.button("📤 Déconnexion", key="home_logout_button"):
                         st.session_state.authenticated = False
                         st.session_state.username = ""
+                        release_session_dataset()
+                        discard_pending_export()
                         st.session_state.is_authenticated = False
                         st.session_state.user_email = ""
                         st.experimental_rerun()
@@ -118,122 +142,156 @@ def create_menu():
         st.markdown("---")
 
 
-def _get_connection():
-    """Retourne une connexion MySQL ou lève une erreur."""
-    return mysql.connector.connect(**DB_CONFIG)
+def _hash_password(password: str, salt=None, iterations=PASSWORD_KDF_ITERATIONS) -> str:
+    """Hachage PBKDF2-SHA256 salé, encodé `pbkdf2_sha256$<itérations>$<sel>$<empreinte>`."""
+    salt = salt if salt is not None else secrets.token_bytes(PASSWORD_SALT_BYTES)
+    digest = hashlib.pbkdf2_hmac("sha256", password.encode(), salt, iterations)
+    return f"pbkdf2_sha256${iterations}${salt.hex()}${digest.hex()}"
 
 
-def _hash_password(password: str) -> str:
-    return hashlib.sha256(password.encode()).hexdigest()
+def _check_password(password: str, stored: str):
+    """Vérifie `password` contre le hachage stocké ; retourne (valide, à_rehacher)."""
+    if stored.startswith("pbkdf2_sha256$"):
+        _, iterations, salt, expected = stored.split("$")
+        candidate = _hash_password(password, bytes.fromhex(salt), int(iterations))
+        valid = hmac.compare_digest(candidate.rsplit("$", 1)[1], expected)
+        return valid, valid and int(iterations) < PASSWORD_KDF_ITERATIONS
+    valid = hmac.compare_digest(hashlib.sha256(password.encode()).hexdigest(), stored)
+    return valid, valid
 
 
-def verify_credentials(email: str, password: str):
-    """Retourne l'e-mail si les identifiants sont valides."""
-    connection = None
+@st.cache_resource
+def _auth_service():
+    """Pool de vérification, cache des connexions vérifiées et file des last_login."""
+    return {
+        "executor": ThreadPoolExecutor(max_workers=AUTH_WORKERS, thread_name_prefix="auth"),
+        "secret": secrets.token_bytes(32),
+        "logins": _LRUCache(LOGIN_CACHE_SIZE),
+        "lock": threading.Lock(),
+        "pending_logins": {},
+        "flush_timer": None,
+    }
+
+
+def _login_token(service, email, password):
+    # Empreinte rapide propre au processus : le cache ne conserve jamais le mot de passe.
+    return hmac.new(service["secret"], f"{email}\0{password}".encode(), hashlib.sha256).digest()
+
+
+def _flush_last_logins(service):
+    with service["lock"]:
+        pending, service["pending_logins"] = service["pending_logins"], {}
+    if not pending:
+        return
+    connection = cursor = None
+    try:
+        connection = _get_connection()
+        cursor = connection.cursor()
+        cursor.executemany(
+            "UPDATE users SET last_login = %s WHERE email = %s",
+            [(when, email) for email, when in pending.items()],
+        )
+        connection.commit()
+    except Error:
+        # Horodatages remis en file pour la prochaine tentative.
+        with service["lock"]:
+            for email, when in pending.items():
+                service["pending_logins"].setdefault(email, when)
+    finally:
+        _release_connection(connection, cursor)
+
+
+def _scheduled_flush(service):
+    with service["lock"]:
+        service["flush_timer"] = None
+    _flush_last_logins(service)
+
+
+def _record_login(service, email):
+    """Met `last_login` en file ; un minuteur écrit la file en un seul lot LAST_LOGIN_FLUSH_SECONDS plus tard."""
+    with service["lock"]:
+        service["pending_logins"][email] = datetime.now()
+        if service["flush_timer"] is not None:
+            return
+        timer = threading.Timer(LAST_LOGIN_FLUSH_SECONDS, _scheduled_flush, args=(service,))
+        timer.daemon = True
+        service["flush_timer"] = timer
+    timer.start()
+
+
+def _verify_credentials_job(email: str, password: str):
+    """Requête et hachage exécutés dans un worker du pool d'authentification."""
+    connection = cursor = None
     try:
         connection = _get_connection()
         cursor = connection.cursor()
-        query = "SELECT email FROM users WHERE email = %s AND password_hash = %s"
-        cursor.execute(query, (email, _hash_password(password)))
+        cursor.execute("SELECT email, password_hash FROM users WHERE email = %s AND is_active", (email,))
         result = cursor.fetchone()
-        return result[0] if result else None
+        if not result:
+            return None
+        valid, needs_rehash = _check_password(password, result[1])
+        if not valid:
+            return None
+        if needs_rehash:
+            cursor.execute("UPDATE users SET password_hash = %s WHERE email = %s", (_hash_password(password), email))
+            connection.commit()
+        return result[0]
+    finally:
+        _release_connection(connection, cursor)
+
+
+def verify_credentials(email: str, password: str):
+    """Retourne l'e-mail si les identifiants sont valides."""
+    service = _auth_service()
+    token = _login_token(service, email, password)
+    cached = service["logins"].get(email)
+    if cached is not None and cached[0] > time.monotonic() and hmac.compare_digest(cached[1], token):
+        _record_login(service, cached[2])
+        return cached[2]
+    try:
+        user_email = service["executor"].submit(_verify_credentials_job, email, password).result(timeout=AUTH_TIMEOUT)
     except Error as e:
         st.error(f"Erreur lors de la connexion à la base de données : {e}")
         return None
-    finally:
-        if connection and connection.is_connected():
-            cursor.close()
-            connection.close()
+    except TimeoutError:
+        st.error("Le service d'authentification est momentanément saturé, veuillez réessayer.")
+        return None
+    if user_email:
+        service["logins"].put(email, (time.monotonic() + LOGIN_CACHE_TTL, token, user_email))
+        _record_login(service, user_email)
+    return user_email
 
 
 def register_user(email: str, password: str) -> bool:
     """Crée un utilisateur. Retourne True si l'inscription réussit."""
-    connection = None
+    try:
+        password_hash = _auth_service()["executor"].submit(_hash_password, password).result(timeout=AUTH_TIMEOUT)
+    except TimeoutError:
+        st.error("Le service d'authentification est momentanément saturé, veuillez réessayer.")
+        return False
+    connection = cursor = None
     try:
         connection = _get_connection()
         cursor = connection.cursor()
         query = "INSERT INTO users (email, password_hash) VALUES (%s, %s)"
-        cursor.execute(query, (email, _hash_password(password)))
+        cursor.execute(query, (email, password_hash))
         connection.commit()
         return True
     except Error as e:
         st.error(f"Erreur lors de l'inscription : {e}")
         return False
     finally:
-        if connection and connection.is_connected():
-            cursor.close()
-            connection.close()
+        _release_connection(connection, cursor)
 
 
 # -------------------------- Helpers dashboard dynamiques ------------------
 def check_data():
-    if "data" not in st.session_state:
+    if "dataset_handle" not in st.session_state and "dataset_id" not in st.session_state:
         st.warning("⚠️ Importez d'abord un dataset depuis la section Téléversement.")
         return False
     return True
 
 
-def _find_column(df, keywords):
-    cols = list(df.columns)
-    lowered = [c.lower() for c in cols]
-    for kw in keywords:
-        for idx, name in enumerate(lowered):
-            if kw in name:
-                return cols[idx]
-    return None
-
-
-def _is_date_like(series: pd.Series, sample=200):
-    if pd.api.types.is_datetime64_any_dtype(series):
-        return True
-    try:
-        values = series.dropna().astype(str)
-        if values.empty:
-            return False
-        sample_values = values.sample(min(len(values), sample), random_state=42)
-        parsed = pd.to_datetime(sample_values, errors="coerce")
-        return parsed.notna().mean() > 0.6
-    except Exception:
-        return False
-
-
-def detect_sales_columns(df: pd.DataFrame):
-    df = df.copy()
-    cols = df.columns
-    date_col = next((c for c in cols if _is_date_like(df[c])), None)
-    revenue_col = _find_column(df, ["revenue", "amount", "total", "sales", "price", "montant"])
-    qty_col = _find_column(df, ["quantity", "qty", "units", "unit", "quantité", "qte"])
-    product_col = _find_column(df, ["product", "item", "sku", "article", "produit"])
-    store_col = _find_column(df, ["store", "shop", "branch", "location", "magasin"])
-    order_col = _find_column(df, ["order_id", "order", "invoice", "transaction", "commande"])
-    customer_col = _find_column(df, ["customer", "client", "buyer", "client_id"])
-
-    if revenue_col is None and qty_col:
-        price_col = _find_column(df, ["price", "unit_price", "cost", "prix"])
-        if price_col:
-            try:
-                df["_computed_revenue"] = pd.to_numeric(df[price_col], errors="coerce") * pd.to_numeric(
-                    df[qty_col], errors="coerce"
-                )
-                revenue_col = "_computed_revenue"
-            except Exception:
-                revenue_col = None
-
-    if date_col:
-        df[date_col] = pd.to_datetime(df[date_col], errors="coerce")
-
-    return {
-        "df": df,
-        "date_col": date_col,
-        "revenue_col": revenue_col,
-        "qty_col": qty_col,
-        "product_col": product_col,
-        "store_col": store_col,
-        "order_col": order_col,
-        "customer_col": customer_col,
-    }
-
-
 def fmt_currency(value, currency_label="GNF"):
     if value is None:
         return "N/A"
@@ -252,24 +310,36 @@ def fmt_number(value):
         return str(value)
 
 
-@st.cache_data(ttl=300)
-def compute_time_series(df: pd.DataFrame, date_col: str, value_col: str, freq="D"):
-    subset = df[[date_col, value_col]].dropna()
-    if subset.empty:
-        return pd.DataFrame()
-    subset = subset.assign(date=pd.to_datetime(subset[date_col]).dt.floor(freq))
-    aggregated = subset.groupby("date")[value_col].sum().reset_index().sort_values("date")
-    return aggregated
-
-
-# ------------ Helpers spécifiques à l'analyse produits --------------------
-SEUIL_STOCK_BAS = 10
-SEUIL_MARGE_CRITIQUE = 15  # pourcentage
-TOP_N = 10
+def show_chart(fig):
+    """Affiche `fig` en bornant la taille du JSON envoyé au navigateur."""
+    size = len(fig.to_json())
+    if size > CHART_MAX_PAYLOAD_BYTES:
+        ratio = 0.95 * CHART_MAX_PAYLOAD_BYTES / size  # marge pour la mise en page, non réduite
+        for trace in fig.data:
+            n = len(trace.x) if getattr(trace, "x", None) is not None else 0
+            if n < 3 or getattr(trace, "y", None) is None:
+                continue
+            keep = max(3, int(n * ratio))
+            xs, ys = pd.Series(trace.x), pd.to_numeric(pd.Series(trace.y), errors="coerce")
+            if "lines" in (getattr(trace, "mode", None) or "") and pd.api.types.is_numeric_dtype(ys):
+                if pd.api.types.is_datetime64_any_dtype(xs) or not pd.api.types.is_numeric_dtype(xs):
+                    xs = pd.to_datetime(xs).astype("datetime64[ns]").astype(np.int64)
+                indices = lttb_indices(xs.to_numpy(), ys.to_numpy(), keep)
+            else:
+                indices = np.linspace(0, n - 1, keep).astype(np.intp)
+            updates = {"x": np.asarray(trace.x)[indices], "y": np.asarray(trace.y)[indices]}
+            for attr in ("hovertext", "customdata", "marker_size", "marker_color"):
+                value = trace
+                for part in attr.split("_"):
+                    value = getattr(value, part, None)
+                if value is not None and not isinstance(value, str) and not np.isscalar(value) and len(value) == n:
+                    updates[attr] = np.asarray(value)[indices]
+            trace.update(**updates)
+    st.plotly_chart(fig, use_container_width=True)
 
 
 def check_product_data():
-    if "data" not in st.session_state:
+    if "dataset_handle" not in st.session_state and "dataset_id" not in st.session_state:
         st.warning("⚠️ Veuillez d'abord importer vos données dans la page Téléversement")
         return False
     return True
@@ -282,56 +352,65 @@ def format_currency(value):
         return str(value)
 
 
-def normalize_product_columns(df: pd.DataFrame) -> pd.DataFrame:
-    col_map = {
-        "product": "produit",
-        "product_name": "produit",
-        "item": "produit",
-        "name": "produit",
-        "quantity": "quantite",
-        "qty": "quantite",
-        "amount": "quantite",
-        "price": "prix_unitaire",
-        "unit_price": "prix_unitaire",
-        "prix_unitaire": "prix_unitaire",
-        "cost": "cout_unitaire",
-        "cost_unit": "cout_unitaire",
-        "unit_cost": "cout_unitaire",
-        "stock": "stock",
-        "inventory": "stock",
-        "date": "date",
-        "date_vente": "date",
-        "sale_date": "date",
-        "categorie": "categorie",
-        "category": "categorie",
-    }
-    mapping = {}
-    for col in df.columns:
-        key = col.strip().lower().replace(" ", "_")
-        if key in col_map:
-            mapping[col] = col_map[key]
-    if mapping:
-        df = df.rename(columns=mapping)
-    if "date" in df.columns:
-        try:
-            df["date"] = pd.to_datetime(df["date"])
-        except Exception:
-            pass
-    return df
-
-
-def calculate_product_metrics(df: pd.DataFrame):
-    metrics = {}
-    if all(c in df.columns for c in ["quantite", "prix_unitaire"]):
-        metrics["ventes"] = df["quantite"].sum()
-        metrics["ca"] = (df["quantite"] * df["prix_unitaire"]).sum()
-        if "cout_unitaire" in df.columns:
-            metrics["marge"] = ((df["prix_unitaire"] - df["cout_unitaire"]) * df["quantite"]).sum()
-            metrics["taux_marge"] = (metrics["marge"] / metrics["ca"]) * 100 if metrics["ca"] else 0
-    if "stock" in df.columns:
-        metrics["stock_total"] = df["stock"].sum()
-        metrics["produits_stock_bas"] = int(df[df["stock"] < SEUIL_STOCK_BAS].shape[0])
-    return metrics
+def discard_pending_export(keep=None):
+    """Supprime le dernier fichier exporté par la session, sauf s'il s'agit de `keep`."""
+    stale = st.session_state.pop("pending_export", None)
+    if stale and stale != str(keep):
+        Path(stale).unlink(missing_ok=True)
+
+
+def download_file_button(label, path: Path, file_name, mime, **kwargs):
+    """Bouton de téléchargement alimenté depuis un fichier, lu seulement au clic."""
+    # Le fichier reste disponible pour un nouveau clic jusqu'à l'export suivant ou la déconnexion.
+    discard_pending_export(keep=path)
+    st.session_state["pending_export"] = str(path)
+    return st.download_button(label, path.read_bytes, file_name, mime, **kwargs)
+
+
+def release_session_dataset():
+    """Rend la référence de la session courante sur son dataset en mémoire."""
+    st.session_state.pop("dataset_lineage", None)
+    handle = st.session_state.pop("dataset_handle", None)
+    if handle is not None:
+        handle.release()
+
+
+def session_dataset() -> DatasetHandle:
+    """Handle du dataset de la session ; un dataset stocké sélectionné est inscrit au registre au besoin."""
+    handle = st.session_state.get("dataset_handle")
+    if handle is None:
+        handle = acquire_dataset(dataset_id=st.session_state["dataset_id"])
+        st.session_state["dataset_handle"] = handle
+    return handle
+
+
+def load_session_data(columns=None):
+    """Dataset de la session courante, restreint à `columns` si précisé."""
+    data = session_dataset().frame()
+    return data[[c for c in columns if c in data.columns]] if columns else data
+
+
+# ------------------ Agrégats calculés côté MySQL --------------------------
+def select_query_backend(key):
+    """Source des agrégats : frame de la session ou requêtes SQL sur `ventes`."""
+    if "dataset_id" not in st.session_state:
+        return "session"
+    return st.sidebar.radio("Source des données", list(QUERY_BACKENDS), format_func=QUERY_BACKENDS.get, key=key)
+
+
+def _forecast_source():
+    """Clé de cache, identifiant, chargeur, lignée et date de référence du dataset de la session."""
+    handle = session_dataset()
+    dataset_id = handle.dataset_id
+    lineage = st.session_state.get("dataset_lineage") or handle.key
+
+    def load_raw():
+        data = handle.frame()
+        return data[product_source_columns(data.columns)]
+
+    if dataset_id is None:
+        return handle.key, None, load_raw, lineage, 0.0
+    return dataset_id, dataset_id, load_raw, lineage, _dataset_path(dataset_id).stat().st_mtime
 
 
 def render_home_page():
@@ -553,6 +632,7 @@ def render_home_page():
         unsafe_allow_html=True,
     )
 
+
 def render_dashboard_page():
     hero_img = IMAGES["dashboard_hero"]
     st.markdown(
@@ -684,17 +764,6 @@ def render_dashboard_page():
     if not check_data():
         return
 
-    raw = st.session_state["data"]
-    detected = detect_sales_columns(raw)
-    df = detected["df"]
-    date_col = detected["date_col"]
-    revenue_col = detected["revenue_col"]
-    qty_col = detected["qty_col"]
-    product_col = detected["product_col"]
-    store_col = detected["store_col"]
-    order_col = detected["order_col"]
-    customer_col = detected["customer_col"]
-
     st.sidebar.header("Paramètres affichage")
     top_n = st.sidebar.number_input("Top N (produits/magasins)", min_value=3, max_value=50, value=10, step=1)
     granularity = st.sidebar.selectbox(
@@ -704,19 +773,70 @@ def render_dashboard_page():
         format_func=lambda x: {"D": "Quotidien", "W": "Hebdo", "M": "Mensuel"}[x],
     )
     currency_label = st.sidebar.text_input("Symbole devise (optionnel)", value="€")
+    backend = select_query_backend("dashboard_backend")
+
+    if backend == "mysql":
+        dataset_id = st.session_state["dataset_id"]
+        try:
+            options = query_sales_options(dataset_id)
+            if options is None:
+                st.info("Aucune vente n'est encore chargée en base pour ce dataset.")
+                return
+            date_range = st.sidebar.date_input(
+                "Période",
+                value=(options["min_date"], options["max_date"]),
+                min_value=options["min_date"],
+                max_value=options["max_date"],
+            )
+            start, end = date_range if len(date_range) == 2 else (None, None)
+            rollup = query_dashboard_rollup(dataset_id, start, end)
+            top_products = query_top_products(dataset_id, top_n, start, end)
+            quality = load_quality_profile(dataset_id)
+        except Error as e:
+            st.error(f"Erreur lors de la lecture des ventes en base : {e}")
+            return
+        detected = {
+            "df": rollup["cube"],
+            "date_col": "jour",
+            "revenue_col": "chiffre_affaires",
+            "qty_col": "quantite",
+            "product_col": "produit",
+            "store_col": "zone",
+            "order_col": None,
+            "customer_col": None,
+        }
+    else:
+        raw = load_session_data()
+        detected = detect_sales_columns(raw, session_dataset().key)
+        rollup = sales_rollup(detected)
+        top_products = None
+        quality = dataset_quality(raw, detected["dataset_key"], st.session_state.get("dataset_id"))
+
+    df = detected["df"]
+    date_col = detected["date_col"]
+    revenue_col = detected["revenue_col"]
+    qty_col = detected["qty_col"]
+    product_col = detected["product_col"]
+    store_col = detected["store_col"]
+    order_col = detected["order_col"]
+    customer_col = detected["customer_col"]
 
-    n_rows, n_cols = df.shape
-    global_missing_pct = round(df.isna().sum().sum() / (max(1, n_rows * n_cols)) * 100, 2)
-    duplicates = int(df.duplicated().sum())
+    cube = rollup["cube"]
+    sketches = rollup["sketches"]
+    n_rows, n_cols = rollup["n_rows"], rollup["n_cols"]
+    global_missing_pct = duplicates = None
+    if quality is not None:
+        global_missing_pct = round(quality["missing_cells"] / (max(1, quality["n_rows"] * quality["n_cols"])) * 100, 2)
+        duplicates = quality["duplicates"]
 
     total_revenue = None
     if revenue_col:
-        total_revenue = round(pd.to_numeric(df[revenue_col], errors="coerce").sum(skipna=True))
+        total_revenue = round(cube[revenue_col].sum(skipna=True))
     total_units = None
     if qty_col:
-        total_units = int(pd.to_numeric(df[qty_col], errors="coerce").sum(skipna=True))
-    unique_orders = int(df[order_col].nunique(dropna=True)) if order_col else None
-    unique_customers = int(df[customer_col].nunique(dropna=True)) if customer_col else None
+        total_units = int(cube[qty_col].sum(skipna=True))
+    unique_orders = sketches["order_col"].count() if order_col else None
+    unique_customers = sketches["customer_col"].count() if customer_col else None
     approx_orders = unique_orders if unique_orders is not None and unique_orders > 0 else max(1, n_rows)
 
     avg_order_value = (
@@ -724,7 +844,14 @@ def render_dashboard_page():
     )
 
     if date_col and revenue_col:
-        ts = compute_time_series(df, date_col, revenue_col, freq=granularity)
+        ts = compute_time_series(
+            df,
+            date_col,
+            revenue_col,
+            freq=granularity,
+            dataset_key=detected.get("dataset_key"),
+            lineage=st.session_state.get("dataset_lineage"),
+        )
         if not ts.empty:
             latest_date = ts["date"].max()
             window = timedelta(days=7) if granularity == "D" else timedelta(days=28) if granularity == "W" else timedelta(days=90)
@@ -761,18 +888,18 @@ def render_dashboard_page():
         {
             "title": "Commandes uniques",
             "value": fmt_number(unique_orders if unique_orders is not None else n_rows),
-            "caption": "Transactions distinguées",
+            "caption": "Transactions distinguées (estimation)",
             "tone": "sky",
         },
         {
             "title": "Clients uniques",
             "value": fmt_number(unique_customers),
-            "caption": "Clients identifiés",
+            "caption": "Clients identifiés (estimation)",
             "tone": "rose",
         },
         {
             "title": "Taux de données manquantes",
-            "value": f"{round(global_missing_pct)} %",
+            "value": f"{round(global_missing_pct)} %" if global_missing_pct is not None else "N/A",
             "caption": "Sur l'ensemble des colonnes",
             "tone": "amber",
         },
@@ -820,10 +947,12 @@ def render_dashboard_page():
 
     st.subheader("📈 Évolution temporelle")
     if not ts.empty:
-        line_fig = px.line(ts, x="date", y=revenue_col, title="Revenu — série temporelle", markers=False)
+        line_fig = px.line(
+            downsample_line(ts, "date", revenue_col), x="date", y=revenue_col, title="Revenu — série temporelle", markers=False
+        )
         line_fig.update_traces(line=dict(color="#1f77b4"))
         line_fig.update_layout(margin=dict(t=40, l=10, r=10, b=10), height=360)
-        st.plotly_chart(line_fig, use_container_width=True)
+        show_chart(line_fig)
     else:
         st.info("Pas assez d'informations date+revenue pour tracer la série temporelle.")
 
@@ -832,10 +961,10 @@ def render_dashboard_page():
     if product_col:
         with tp_col:
             st.markdown("**Top produits**")
+            by_product = cube.groupby(product_col, observed=True) if top_products is None else None
             if revenue_col:
-                top_products = (
-                    df.groupby(product_col)[revenue_col].sum().sort_values(ascending=False).head(top_n)
-                )
+                if top_products is None:
+                    top_products = by_product[revenue_col].sum().sort_values(ascending=False).head(top_n)
                 fig = px.bar(
                     top_products.reset_index(),
                     x=product_col,
@@ -843,7 +972,7 @@ def render_dashboard_page():
                     title=f"Top {top_n} produits par revenu",
                 )
             elif qty_col:
-                top_products = df.groupby(product_col)[qty_col].sum().sort_values(ascending=False).head(top_n)
+                top_products = by_product[qty_col].sum().sort_values(ascending=False).head(top_n)
                 fig = px.bar(
                     top_products.reset_index(),
                     x=product_col,
@@ -851,7 +980,7 @@ def render_dashboard_page():
                     title=f"Top {top_n} produits par unités",
                 )
             else:
-                top_products = df[product_col].value_counts().head(top_n)
+                top_products = by_product["nb_lignes"].sum().sort_values(ascending=False).head(top_n)
                 fig = px.bar(
                     top_products.reset_index(),
                     x=product_col,
@@ -859,17 +988,16 @@ def render_dashboard_page():
                     title=f"Top {top_n} produits (occurrences)",
                 )
             fig.update_layout(height=380, margin=dict(t=40, l=10, r=10, b=10))
-            st.plotly_chart(fig, use_container_width=True)
+            show_chart(fig)
     else:
         tp_col.info("Aucune colonne produit détectée")
 
     if store_col:
         with ts_col:
             st.markdown("**Top magasins**")
+            by_store = cube.groupby(store_col, observed=True)
             if revenue_col:
-                top_stores = (
-                    df.groupby(store_col)[revenue_col].sum().sort_values(ascending=False).head(top_n)
-                )
+                top_stores = by_store[revenue_col].sum().sort_values(ascending=False).head(top_n)
                 fig2 = px.bar(
                     top_stores.reset_index(),
                     x=store_col,
@@ -877,7 +1005,7 @@ def render_dashboard_page():
                     title=f"Top {top_n} magasins par revenu",
                 )
             elif qty_col:
-                top_stores = df.groupby(store_col)[qty_col].sum().sort_values(ascending=False).head(top_n)
+                top_stores = by_store[qty_col].sum().sort_values(ascending=False).head(top_n)
                 fig2 = px.bar(
                     top_stores.reset_index(),
                     x=store_col,
@@ -885,7 +1013,7 @@ def render_dashboard_page():
                     title=f"Top {top_n} magasins par unités",
                 )
             else:
-                top_stores = df[store_col].value_counts().head(top_n)
+                top_stores = by_store["nb_lignes"].sum().sort_values(ascending=False).head(top_n)
                 fig2 = px.bar(
                     top_stores.reset_index(),
                     x=store_col,
@@ -893,21 +1021,51 @@ def render_dashboard_page():
                     title=f"Top {top_n} magasins (occ.)",
                 )
             fig2.update_layout(height=380, margin=dict(t=40, l=10, r=10, b=10))
-            st.plotly_chart(fig2, use_container_width=True)
+            show_chart(fig2)
     else:
         ts_col.info("Aucune colonne magasin détectée")
 
     st.subheader("🔎 Alertes & insights automatiques")
     alerts = []
-    if global_missing_pct > 20:
+    if global_missing_pct is not None and global_missing_pct > 20:
         alerts.append(f"⚠️ Taux de valeurs manquantes élevé: {global_missing_pct}%")
-    if duplicates > 0:
-        alerts.append(f"⚠️ {duplicates} lignes dupliquées détectées")
+    if quality is not None:
+        alerts.extend(quality_alerts(quality))
     if revenue_col and ts.shape[0] > 0:
         peak = ts.loc[ts[revenue_col].idxmax()]
         trough = ts.loc[ts[revenue_col].idxmin()]
         alerts.append(f"📌 Meilleure date: {peak['date'].date()} ({fmt_currency(peak[revenue_col], currency_label)})")
         alerts.append(f"📌 Pire date: {trough['date'].date()} ({fmt_currency(trough[revenue_col], currency_label)})")
+        daily = compute_time_series(
+            df,
+            date_col,
+            revenue_col,
+            freq="D",
+            dataset_key=detected.get("dataset_key"),
+            lineage=st.session_state.get("dataset_lineage"),
+        )
+        calendar = calendar_for(daily["date"].min(), daily["date"].max() + pd.Timedelta(days=14))
+        holiday_flags = calendar.features(daily["date"])["est_ferie"].to_numpy(dtype=bool)
+        if holiday_flags.any() and (~holiday_flags).any():
+            ordinary = daily[revenue_col].to_numpy()[~holiday_flags].mean()
+            if ordinary:
+                uplift = (daily[revenue_col].to_numpy()[holiday_flags].mean() / ordinary - 1) * 100
+                alerts.append(f"🎉 Jours fériés : {uplift:+.1f}% de revenu moyen vs jours ordinaires ({holiday_flags.sum()} jours)")
+        upcoming = pd.date_range(daily["date"].max() + pd.Timedelta(days=1), periods=14, freq="D")
+        next_holidays = upcoming[calendar.features(upcoming)["est_ferie"].to_numpy(dtype=bool)]
+        if len(next_holidays):
+            name = calendar.names.get(next_holidays[0], "jour férié")
+            alerts.append(f"📅 Prochain férié : {name} le {next_holidays[0].date()} — anticipez les stocks")
+    if revenue_col and date_col and store_col:
+        try:
+            weather = weather_by_day_zone(df, date_col, store_col, revenue_col, detected.get("dataset_key")).dropna(subset=["temperature"])
+        except Error:
+            weather = pd.DataFrame()
+        if len(weather) >= WEATHER_MIN_POINTS:
+            for col, label in (("temperature", "la température"), ("precipitation", "les précipitations")):
+                r = weather[revenue_col].corr(weather[col].astype(np.float64))
+                if pd.notna(r) and abs(r) >= 0.3:
+                    alerts.append(f"🌦️ Revenu journalier par zone corrélé à {label} (r = {r:+.2f}, {len(weather)} jours × zones)")
     if alerts:
         for alert in alerts:
             st.info(alert)
@@ -933,23 +1091,63 @@ def render_dashboard_page():
     st.table(pd.DataFrame(cols_summary))
 
     st.subheader("⬇️ Export rapide")
-    export_cols = [c for c in [date_col, product_col, store_col, order_col, customer_col, revenue_col, qty_col] if c]
+    export_cols = [c for c in [date_col, product_col, store_col, order_col, customer_col, revenue_col, qty_col] if c in df.columns]
     if export_cols:
-        tmp_export = df[export_cols].copy()
-        tmp_csv = tmp_export.to_csv(index=False).encode("utf-8")
-        st.download_button("Télécharger extrait CSV (colonnes clés)", tmp_csv, "sales_extract.csv", "text/csv")
+        format_col, button_col = st.columns([1, 2])
+        export_format = format_col.selectbox("Format d'export", list(EXPORT_FORMATS), key="quick_export_format")
+        if button_col.button("Préparer l'extrait (colonnes clés)"):
+            progress = st.progress(0.0, text="Écriture de l'extrait…")
+            dataset_id = st.session_state.get("dataset_id")
+            stored = dataset_id is not None and _dataset_path(dataset_id).exists()
+            if stored and set(export_cols) <= set(dataset_columns(dataset_id)):
+                # Relu bloc par bloc depuis le Parquet : seul le bloc courant est en mémoire.
+                chunks = iter_dataset_chunks(dataset_id, export_cols, EXPORT_CHUNK_ROWS)
+                total_rows = pq.read_metadata(str(_dataset_path(dataset_id))).num_rows
+                path = write_chunks_to_file(
+                    chunks,
+                    export_format,
+                    total_rows=total_rows,
+                    on_progress=lambda frac: progress.progress(frac, text="Écriture de l'extrait…"),
+                )
+            else:
+                path = write_frame_to_file(
+                    df[export_cols],
+                    export_format,
+                    on_progress=lambda frac: progress.progress(frac, text="Écriture de l'extrait…"),
+                )
+            progress.empty()
+            suffix, mime = EXPORT_FORMATS[export_format]
+            download_file_button("Télécharger l'extrait", path, f"sales_extract.{suffix}", mime)
     else:
         st.info("Aucune colonne clé détectée pour export")
 
     with st.expander("🔍 Explorer les données brutes (filtrer)"):
-        rows = st.slider("Lignes à afficher", 5, 500, 50)
-        sel_cols = st.multiselect(
-            "Colonnes",
-            df.columns.tolist(),
-            default=export_cols[:10] if export_cols else df.columns.tolist()[:10],
+        dataset_id = st.session_state.get("dataset_id")
+        if dataset_id is not None and _dataset_path(dataset_id).exists():
+            explorer = DatasetExplorer(dataset_id=dataset_id)
+        else:
+            explorer = DatasetExplorer(frame=df, dataset_key=detected.get("dataset_key"))
+        default_cols = [c for c in export_cols if c in explorer.columns] or explorer.columns[:10]
+        sel_cols = st.multiselect("Colonnes", explorer.columns, default=default_cols[:10])
+        sort_col_ui, order_col_ui, filter_col_ui, value_col_ui = st.columns(4)
+        sort_col = sort_col_ui.selectbox("Trier par", ["(ordre du fichier)"] + explorer.columns)
+        ascending = order_col_ui.radio("Ordre", ["Croissant", "Décroissant"], horizontal=True) == "Croissant"
+        filter_col = filter_col_ui.selectbox("Filtrer la colonne", ["(aucune)"] + explorer.columns)
+        filter_value = value_col_ui.text_input("Valeur recherchée")
+        positions = explorer.order(
+            sort_col=None if sort_col == "(ordre du fichier)" else sort_col,
+            ascending=ascending,
+            filter_col=None if filter_col == "(aucune)" else filter_col,
+            filter_value=filter_value,
         )
-        view = df[sel_cols].head(rows)
-        st.dataframe(view)
+        total = explorer.n_rows if positions is None else len(positions)
+        size_col_ui, page_col_ui = st.columns(2)
+        page_size = size_col_ui.selectbox("Lignes par page", EXPLORER_PAGE_SIZES, index=1)
+        n_pages = max(1, -(-total // page_size))
+        page = page_col_ui.number_input("Page", min_value=1, max_value=n_pages, value=1, step=1)
+        if sel_cols:
+            st.dataframe(explorer.page(sel_cols, int(page) - 1, page_size, positions))
+        st.caption(f"{total:,} lignes — page {int(page)} / {n_pages:,}")
 
 
 def render_analytics_page():
@@ -1003,52 +1201,101 @@ def render_analytics_page():
     if not check_product_data():
         return
 
-    df = normalize_product_columns(st.session_state["data"].copy())
-    if "produit" not in df.columns:
-        st.error("La colonne 'produit' est introuvable dans votre dataset.")
-        st.info(f"Colonnes disponibles : {', '.join(df.columns)}")
-        st.stop()
-
-    with st.sidebar:
-        st.header("🎯 Paramètres d'analyse")
-        st.subheader("📅 Période")
-        if "date" in df.columns:
-            min_date = pd.to_datetime(df["date"]).min()
-            max_date = pd.to_datetime(df["date"]).max()
+    backend = select_query_backend("analytics_backend")
+    if backend == "mysql":
+        dataset_id = st.session_state["dataset_id"]
+        try:
+            options = query_sales_options(dataset_id)
+        except Error as e:
+            st.error(f"Erreur lors de la lecture des ventes en base : {e}")
+            return
+        if options is None:
+            st.info("Aucune vente n'est encore chargée en base pour ce dataset.")
+            return
+        with st.sidebar:
+            st.header("🎯 Paramètres d'analyse")
+            st.subheader("📅 Période")
             date_range = st.date_input(
                 "Sélectionner la période",
-                value=(min_date, max_date),
-                min_value=min_date,
-                max_value=max_date,
+                value=(options["min_date"], options["max_date"]),
+                min_value=options["min_date"],
+                max_value=options["max_date"],
             )
-            if len(date_range) == 2:
-                df = df[(df["date"] >= pd.Timestamp(date_range[0])) & (df["date"] <= pd.Timestamp(date_range[1]))]
-
-        st.subheader("🏷️ Filtres")
-        if "categorie" in df.columns:
-            categories = ["Tous"] + sorted(df["categorie"].dropna().unique().tolist())
-            selected_cat = st.selectbox("Catégorie", categories)
-            if selected_cat != "Tous":
-                df = df[df["categorie"] == selected_cat]
+            st.subheader("🏷️ Filtres")
+            selected_cat = st.selectbox("Catégorie", ["Tous"] + options["categories"])
+            selected_products = st.multiselect("Produits spécifiques", options["produits"])
+        sql_filters = {
+            "start": date_range[0] if len(date_range) == 2 else None,
+            "end": date_range[1] if len(date_range) == 2 else None,
+            "categorie": None if selected_cat == "Tous" else selected_cat,
+            "produits": tuple(selected_products),
+        }
+        try:
+            plan = query_analytics_plan(dataset_id, **sql_filters)
+        except Error as e:
+            st.error(f"Erreur lors du calcul des agrégats en base : {e}")
+            return
+    else:
+        df = normalize_product_columns(load_session_data(product_source_columns(session_dataset().columns)))
+        if "produit" not in df.columns:
+            st.error("La colonne 'produit' est introuvable dans votre dataset.")
+            st.info(f"Colonnes disponibles : {', '.join(df.columns)}")
+            st.stop()
+
+        dataset_key = session_dataset().key
+        index = filter_index(df, dataset_key)
+        filters = {}
+        with st.sidebar:
+            st.header("🎯 Paramètres d'analyse")
+            st.subheader("📅 Période")
+            bounds = index.date_bounds()
+            if bounds is not None:
+                min_date, max_date = bounds
+                date_range = st.date_input(
+                    "Sélectionner la période",
+                    value=(min_date, max_date),
+                    min_value=min_date,
+                    max_value=max_date,
+                )
+                if len(date_range) == 2:
+                    filters["start"], filters["end"] = date_range
+
+            st.subheader("🏷️ Filtres")
+            selected_cat = None
+            if "categorie" in df.columns:
+                selected_cat = st.selectbox("Catégorie", ["Tous"] + index.options("categorie"))
+                if selected_cat != "Tous":
+                    filters["categorie"] = selected_cat
+                else:
+                    selected_cat = None
 
-        if "produit" in df.columns:
-            products = sorted(df["produit"].dropna().unique().tolist())
-            selected_products = st.multiselect("Produits spécifiques", products)
-            if selected_products:
-                df = df[df["produit"].isin(selected_products)]
+            if "produit" in df.columns:
+                selected_products = st.multiselect("Produits spécifiques", index.options("produit", selected_cat))
+                if selected_products:
+                    filters["produits"] = selected_products
 
-    metrics = calculate_product_metrics(df)
+        df = index.apply(df, **filters)
+        plan_key = (dataset_key, tuple((k, tuple(v) if isinstance(v, list) else v) for k, v in sorted(filters.items())))
+        plan = build_analytics_plan(df, plan_key)
+    by_product = plan["by_product"]
+    metrics = plan["metrics"]
 
     st.header("📊 Tableau de Bord")
     kpi1, kpi2, kpi3, kpi4 = st.columns(4)
     with kpi1:
-        st.metric("Produits Actifs", f"{df['produit'].nunique():,}", help="Nombre total de produits différents vendus")
+        st.metric("Produits Actifs", f"{plan['n_products']:,}", help="Nombre total de produits différents vendus")
     with kpi2:
         st.metric("Ventes Totales", format_currency(metrics.get("ca", 0)), help="Chiffre d'affaires total")
     with kpi3:
-        marge = metrics.get("marge", 0)
-        taux_marge = metrics.get("taux_marge", 0)
-        st.metric("Marge Brute", format_currency(marge), f"{taux_marge:.1f}%", help="Marge brute et taux de marge")
+        if "marge" in metrics:
+            st.metric(
+                "Marge Brute",
+                format_currency(metrics["marge"]),
+                f"{metrics['taux_marge']:.1f}%",
+                help="Marge brute et taux de marge",
+            )
+        else:
+            st.metric("Marge Brute", "N/D", help="Aucun coût unitaire renseigné pour ces ventes")
     with kpi4:
         st.metric(
             "Alerte Stock",
@@ -1062,13 +1309,8 @@ def render_analytics_page():
     with tab1:
         col1, col2 = st.columns([2, 1])
         with col1:
-            if "produit" in df.columns and all(c in df.columns for c in ["quantite", "prix_unitaire"]):
-                ca_by_product = (
-                    df.groupby("produit")
-                    .apply(lambda x: (x["quantite"] * x["prix_unitaire"]).sum())
-                    .sort_values(ascending=False)
-                    .head(TOP_N)
-                )
+            if "ca" in by_product.columns:
+                ca_by_product = by_product["ca"].sort_values(ascending=False).head(TOP_N).rename(None)
                 fig = px.bar(
                     ca_by_product,
                     title=f"Top {TOP_N} Produits par Chiffre d'Affaires",
@@ -1076,30 +1318,22 @@ def render_analytics_page():
                     template="plotly_white",
                 )
                 fig.update_layout(showlegend=False, height=400)
-                st.plotly_chart(fig, use_container_width=True)
+                show_chart(fig)
         with col2:
             st.subheader("🏆 Top Performers")
-            top_products = (
-                df.groupby("produit")
-                .agg({"quantite": "sum", "prix_unitaire": "mean"})
-                .sort_values("quantite", ascending=False)
-                .head(5)
-            )
-            st.dataframe(
-                top_products.style.format({"quantite": "{:,.0f}", "prix_unitaire": "{:,.0f} GNF"}),
-                height=400,
-            )
+            if all(c in by_product.columns for c in ["quantite", "prix_unitaire"]):
+                top_products = by_product[["quantite", "prix_unitaire"]].sort_values("quantite", ascending=False).head(5)
+                st.dataframe(
+                    top_products.style.format({"quantite": "{:,.0f}", "prix_unitaire": "{:,.0f} GNF"}),
+                    height=400,
+                )
 
     with tab2:
-        if all(c in df.columns for c in ["quantite", "prix_unitaire", "cout_unitaire"]):
-            df["marge"] = (df["prix_unitaire"] - df["cout_unitaire"]) * df["quantite"]
-            rentabilite = (
-                df.groupby("produit")
-                .agg({"marge": "sum", "quantite": "sum"})
-                .reset_index()
-            )
+        if "marge" in by_product.columns:
+            rentabilite = by_product[["marge", "quantite"]].reset_index()
             fig = px.scatter(
                 rentabilite,
+                render_mode=scatter_render_mode(len(rentabilite)),
                 x="quantite",
                 y="marge",
                 size="marge",
@@ -1111,35 +1345,29 @@ def render_analytics_page():
             )
             fig.update_traces(marker=dict(sizemode="diameter", opacity=0.8))
             fig.update_layout(height=400)
-            st.plotly_chart(fig, use_container_width=True)
+            show_chart(fig)
         else:
             st.info("Ajoutez les colonnes 'prix_unitaire', 'quantite' et 'cout_unitaire' pour analyser la rentabilité.")
 
     with tab3:
-        if "stock" in df.columns:
-            stock = df.groupby("produit").agg({"stock": "sum", "quantite": "sum"}).reset_index()
+        if "stock" in by_product.columns:
+            stock = top_k_with_others(by_product["stock"]).reset_index()
             fig = px.bar(
                 stock,
                 x="produit",
                 y="stock",
-                title="📦 Niveau de Stock par Produit",
+                title=f"📦 Niveau de Stock par Produit (top {CHART_MAX_BARS})" if len(by_product) > CHART_MAX_BARS else "📦 Niveau de Stock par Produit",
                 labels={"stock": "Stock Actuel", "produit": "Produit"},
                 template="plotly_white",
             )
             fig.update_layout(showlegend=False, height=400, xaxis_tickangle=-45)
-            st.plotly_chart(fig, use_container_width=True)
+            show_chart(fig)
         else:
             st.info("Ajoutez la colonne 'stock' pour suivre les niveaux de stock.")
 
     with tab4:
-        if "date" in df.columns and "quantite" in df.columns:
-            df["date"] = pd.to_datetime(df["date"])
-            ventes = (
-                df.groupby(df["date"].dt.to_period("M"))
-                .agg({"quantite": "sum", "prix_unitaire": "mean"})
-                .reset_index()
-            )
-            ventes["date"] = ventes["date"].dt.to_timestamp()
+        ventes = plan["monthly"]
+        if not ventes.empty:
             fig = make_subplots(
                 rows=2,
                 cols=1,
@@ -1148,61 +1376,43 @@ def render_analytics_page():
                 subplot_titles=("Ventes Mensuelles", "Prix Unitaire Moyen Mensuel"),
             )
             fig.add_trace(go.Bar(x=ventes["date"], y=ventes["quantite"], name="Ventes"), row=1, col=1)
-            fig.add_trace(
-                go.Scatter(x=ventes["date"], y=ventes["prix_unitaire"], name="Prix Unitaire", mode="lines+markers"),
-                row=2,
-                col=1,
-            )
+            if "prix_unitaire" in ventes.columns:
+                fig.add_trace(
+                    go.Scatter(x=ventes["date"], y=ventes["prix_unitaire"], name="Prix Unitaire", mode="lines+markers"),
+                    row=2,
+                    col=1,
+                )
             fig.update_layout(height=600, title_text="📈 Tendances des Ventes et Prix dans le Temps", template="plotly_white")
-            st.plotly_chart(fig, use_container_width=True)
+            show_chart(fig)
         else:
             st.info("Ajoutez les colonnes 'date' et 'quantite' pour visualiser les tendances.")
 
     st.header("📥 Export et Rapports")
     col1, col2 = st.columns([1, 2])
     with col1:
-        report_type = st.selectbox("Type de rapport", ["Rapport complet", "Synthèse performance", "Analyse stock"])
+        report_type = st.selectbox("Type de rapport", list(REPORT_COLUMNS))
+        report_format = st.selectbox("Format", list(EXPORT_FORMATS))
     with col2:
         if st.button("📥 Générer le rapport", use_container_width=True):
-            products = sorted(df["produit"].dropna().unique().tolist())
-
-            def sum_qty(grp):
-                return grp["quantite"].fillna(0).sum() if "quantite" in grp.columns else 0
-
-            def sum_ca(grp):
-                if "quantite" in grp.columns and "prix_unitaire" in grp.columns:
-                    return (grp["quantite"].fillna(0) * grp["prix_unitaire"].fillna(0)).sum()
-                return 0
-
-            def sum_margin(grp):
-                if all(c in grp.columns for c in ("quantite", "prix_unitaire", "cout_unitaire")):
-                    return ((grp["prix_unitaire"].fillna(0) - grp["cout_unitaire"].fillna(0)) * grp["quantite"].fillna(0)).sum()
-                return 0
-
-            def sum_stock(grp):
-                return grp["stock"].fillna(0).sum() if "stock" in grp.columns else 0
-
-            rows = []
-            for produit in products:
-                grp = df[df["produit"] == produit]
-                rows.append(
-                    {
-                        "Produit": produit,
-                        "Ventes_Totales": sum_qty(grp),
-                        "CA_Total": sum_ca(grp),
-                        "Marge_Totale": sum_margin(grp),
-                        "Stock_Actuel": sum_stock(grp),
-                        "Date_Export": datetime.now().strftime("%Y-%m-%d %H:%M"),
-                    }
-                )
-
-            output = pd.DataFrame(rows)
-            csv = output.to_csv(index=False).encode("utf-8")
-            st.download_button(
+            if backend == "mysql":
+                try:
+                    output = query_product_report(dataset_id, report_type, **sql_filters)
+                except Error as e:
+                    st.error(f"Erreur lors de la génération du rapport : {e}")
+                    return
+            else:
+                output = build_product_report(df, report_type)
+            suffix, mime = EXPORT_FORMATS[report_format]
+            progress = st.progress(0.0, text="Écriture du rapport…")
+            path = write_frame_to_file(
+                output, report_format, on_progress=lambda frac: progress.progress(frac, text="Écriture du rapport…")
+            )
+            progress.empty()
+            download_file_button(
                 "💾 Télécharger le rapport",
-                csv,
-                f"analyse_produits_{datetime.now().strftime('%Y%m%d_%H%M')}.csv",
-                "text/csv",
+                path,
+                f"analyse_produits_{datetime.now().strftime('%Y%m%d_%H%M')}.{suffix}",
+                mime,
             )
 
 
@@ -1351,10 +1561,101 @@ def render_upload_page():
                 )
                 uploaded_file = None
             else:
+                signature = (uploaded_file.name, file_size)
+                if st.session_state.get("upload_signature") != signature:
+                    dataset_name = f"{Path(uploaded_file.name).stem}_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+                    dataset_id = register_dataset(st.session_state.get("user_email", ""), dataset_name)
+                    store_path = _dataset_path(dataset_id) if dataset_id is not None else None
+                    progress = st.progress(0.0, text=f"Lecture de {uploaded_file.name}…")
+                    type_stats = {}
+                    try:
+                        data = ingest_uploaded_file(
+                            uploaded_file,
+                            on_progress=lambda frac: progress.progress(frac, text=f"Lecture de {uploaded_file.name}…"),
+                            store_path=store_path,
+                            type_stats=type_stats,
+                        )
+                    except Exception as e:
+                        progress.empty()
+                        st.error(f"❌ Impossible de lire {uploaded_file.name} : {e}")
+                        data = None
+                        if dataset_id is not None:
+                            deactivate_dataset(dataset_id)
+                            store_path.unlink(missing_ok=True)
+                    if data is not None:
+                        progress.progress(1.0, text="Compactage des types…")
+                        data, st.session_state["upload_memory"] = compact_frame(data)
+                        release_session_dataset()
+                        st.session_state["dataset_handle"] = acquire_dataset(data, dataset_id)
+                        st.session_state["dataset_lineage"] = dataset_lineage(st.session_state.get("user_email", ""), dataset_name)
+                        dataset_key = st.session_state["dataset_handle"].key
+                        progress.progress(1.0, text="Profil qualité…")
+                        store_quality_profile(profile_dataset(data, type_stats), dataset_key, dataset_id)
+                        progress.progress(1.0, text="Préparation des agrégats…")
+                        sales_rollup(detect_sales_columns(data, dataset_key))
+                        progress.progress(1.0, text="Lecture terminée")
+                        del data
+                        st.session_state["upload_signature"] = signature
+                        if dataset_id is not None:
+                            st.session_state["dataset_id"] = dataset_id
+                        else:
+                            st.session_state.pop("dataset_id", None)
+                            st.warning("Le dataset n'a pas pu être historisé : il reste disponible pour cette session uniquement.")
+                        schedule_forecast_precompute(*_forecast_source()[:4])
+                if st.session_state.get("upload_signature") == signature:
+                    n_rows, n_cols = st.session_state["dataset_handle"].shape
+                    st.success(
+                        f"✅ {uploaded_file.name} a été chargé ({n_rows:,} lignes × {n_cols} colonnes). Le dataset est disponible dans vos analyses."
+                    )
+                    memory = st.session_state.get("upload_memory")
+                    if memory:
+                        st.caption(
+                            f"Mémoire : {memory['before'] / 1024**2:,.1f} Mo → {memory['after'] / 1024**2:,.1f} Mo après compactage des types."
+                        )
+
+        if "dataset_id" in st.session_state and st.button("🗄️ Charger les ventes en base (table ventes)"):
+            dataset_id = st.session_state["dataset_id"]
+            source_cols = product_source_columns(dataset_columns(dataset_id))
+            expected_rows = pq.read_metadata(str(_dataset_path(dataset_id))).num_rows
+            progress = st.progress(0.0, text="Chargement des ventes…")
+            try:
+                stats = bulk_load_ventes(
+                    dataset_id,
+                    iter_dataset_chunks(dataset_id, source_cols),
+                    expected_rows=expected_rows,
+                    on_progress=lambda frac, rows: progress.progress(frac, text=f"{rows:,} lignes chargées…"),
+                )
+            except (Error, ValueError) as e:
+                progress.empty()
+                st.error(f"❌ Chargement interrompu : {e}")
+            else:
+                progress.progress(1.0, text="Chargement terminé")
+                query_sales_options.clear()
+                query_dashboard_rollup.clear()
+                query_top_products.clear()
+                query_analytics_plan.clear()
+                query_product_report.clear()
                 st.success(
-                    f"✅ {uploaded_file.name} a été reçu. Vous recevrez une notification dès que le dataset sera disponible dans vos analyses."
+                    f"✅ {stats['rows']:,} lignes chargées en {stats['seconds']:.1f} s ({stats['rows_per_second']:,.0f} lignes/s)."
                 )
 
+        stored = list_user_datasets(st.session_state.get("user_email", ""))
+        if stored:
+            st.markdown("### Datasets enregistrés")
+            labels = {
+                row["dataset_id"]: f"{row['dataset_name']} ({row['upload_date']:%d/%m/%Y %H:%M})" for row in stored
+            }
+            choice = st.selectbox("Recharger un dataset existant", list(labels), format_func=labels.get)
+            if st.button("📂 Ouvrir ce dataset"):
+                release_session_dataset()
+                st.session_state.pop("upload_signature", None)
+                st.session_state["dataset_id"] = choice
+                st.session_state["dataset_handle"] = acquire_dataset(dataset_id=choice)
+                name = next(row["dataset_name"] for row in stored if row["dataset_id"] == choice)
+                st.session_state["dataset_lineage"] = dataset_lineage(st.session_state.get("user_email", ""), name)
+                schedule_forecast_precompute(*_forecast_source()[:4])
+                st.success(f"✅ {labels[choice]} est disponible dans vos analyses.")
+
     step_col, reason_col = st.columns(2)
     with step_col:
         st.markdown("#### Étapes de traitement")
@@ -1408,14 +1709,120 @@ def render_prediction_page():
     col1, col2 = st.columns([1.3, 1])
     with col1:
         with st.form("prediction_form"):
-            horizon = st.select_slider("Horizon", options=["1 semaine", "1 mois", "3 mois"])
-            scenario = st.selectbox("Scénario", ["Tendance actuelle", "Campagne marketing", "Nouveau produit"])
-            budget = st.slider("Budget marketing", min_value=10_000, max_value=150_000, step=5_000, format="%d €")
+            horizon = st.select_slider("Horizon", options=list(FORECAST_HORIZONS))
+            scenario = st.selectbox("Scénario", list(SCENARIOS))
+            engine = st.radio("Moteur de prévision", list(FORECAST_ENGINES), format_func=FORECAST_ENGINES.get, horizontal=True)
+            budget = st.slider(
+                "Budget marketing", min_value=BUDGET_MIN, max_value=BUDGET_MAX, step=BUDGET_STEP, format="%d €"
+            )
             submitted = st.form_submit_button("Lancer la simulation")
         if submitted:
+            if not check_data():
+                return
+            horizon_days = FORECAST_HORIZONS[horizon]
+            dataset_key, dataset_id, load_raw, lineage, reuse_after = _forecast_source()
+            entry = cached_forecast(dataset_key, dataset_id, engine, horizon_days, scenario)
+            if entry is None:
+                # Le précalcul en arrière-plan peut traiter ce même horizon : on attend son résultat.
+                with forecast_lock((dataset_key, engine, horizon_days)):
+                    entry = cached_forecast(dataset_key, dataset_id, engine, horizon_days, scenario)
+                    if entry is None:
+                        progress = st.progress(0.0, text="Entraînement des modèles…")
+                        try:
+                            forecast, recent, stats = compute_baseline_forecast(
+                                engine,
+                                dataset_key,
+                                load_raw(),
+                                horizon_days,
+                                reuse_after=reuse_after,
+                                on_progress=lambda frac: progress.progress(frac, text="Entraînement des modèles…"),
+                                lineage=lineage,
+                            )
+                        except ValueError as e:
+                            progress.empty()
+                            st.error(str(e))
+                            return
+                        except Exception as e:
+                            progress.empty()
+                            st.error(f"Échec de l'entraînement des modèles : {e}")
+                            return
+                        progress.empty()
+                        if stats and stats["mode"] != "réutilisé":
+                            st.caption(
+                                f"Entraînement {stats['mode']} sur {stats['train_rows']:,} lignes — "
+                                f"matrice de features : {stats['feature_bytes'] / 1024**2:,.1f} Mo."
+                            )
+                        try:
+                            cache_forecast(dataset_key, dataset_id, engine, horizon_days, forecast, recent)
+                        except Error as e:
+                            st.error(f"Erreur lors de l'enregistrement des prévisions : {e}")
+                        entry = cached_forecast(dataset_key, dataset_id, engine, horizon_days, scenario)
+            if entry["recent"] is None:
+                history = forecast_series(load_raw()).groupby("ds")["y"].sum()
+                entry["recent"] = history[history.index > history.index.max() - pd.Timedelta(days=28)]
+
+            recent = entry["recent"]
+            baseline = entry["baseline"]
+            projected = baseline.to_numpy() * (1 + entry["profile"] * budget_lift(scenario, budget))
+            growth = (projected.mean() / (recent.sum() / 28) - 1) * 100 if recent.sum() else 0.0
             st.info(
-                f"Projection {horizon.lower()} sous scénario '{scenario}' : croissance estimée +{3 + budget / 100_000:.1f}% vs tendance."
+                f"Projection {horizon.lower()} sous scénario '{scenario}' : {projected.sum():,.0f} unités prévues, "
+                f"soit {growth:+.1f}% vs le rythme des 28 derniers jours."
             )
+            chart = pd.concat(
+                [
+                    pd.DataFrame({"date": recent.index, "unites": recent.to_numpy(), "serie": "Historique"}),
+                    pd.DataFrame({"date": baseline.index, "unites": baseline.to_numpy(), "serie": "Prévision de base"}),
+                    pd.DataFrame({"date": baseline.index, "unites": projected, "serie": f"Scénario : {scenario}"}),
+                ]
+            )
+            fig = px.line(chart, x="date", y="unites", color="serie", title="Demande journalière (unités)")
+            fig.update_layout(height=360, margin=dict(t=40, l=10, r=10, b=10))
+            show_chart(fig)
+
+            sweep = simulate_budget_grid(baseline.to_numpy(), horizon_days)
+            curve = sweep.reset_index().melt(id_vars="budget", var_name="scenario", value_name="unites")
+            fig = px.line(
+                curve, x="budget", y="unites", color="scenario", title=f"Réponse au budget marketing ({horizon.lower()})"
+            )
+            fig.add_vline(x=budget, line_dash="dash", line_color="gray")
+            fig.update_layout(height=320, margin=dict(t=40, l=10, r=10, b=10), xaxis_tickformat=",d")
+            show_chart(fig)
+
+        with st.expander("📈 Tendances Google"):
+            keywords = [k.strip() for k in st.text_input("Mots-clés (séparés par des virgules)").split(",") if k.strip()]
+            offline = st.checkbox("Mode hors ligne (fichiers de tendances locaux)", value=TRENDS_FIXTURE_DIR.exists())
+            if keywords and st.button("🔄 Actualiser les tendances"):
+                progress = st.progress(0.0, text="Mise à jour des tendances…")
+                try:
+                    written = refresh_trends(
+                        keywords,
+                        fixture_dir=TRENDS_FIXTURE_DIR if offline else None,
+                        on_progress=lambda frac: progress.progress(frac, text="Mise à jour des tendances…"),
+                    )
+                    st.success(f"✅ {written:,} scores enregistrés.")
+                except (Error, ValueError) as e:
+                    st.error(f"Erreur lors de la mise à jour des tendances : {e}")
+                finally:
+                    progress.empty()
+            if keywords:
+                try:
+                    trends = load_trends(tuple(keywords))
+                except Error as e:
+                    st.error(f"Erreur lors de la lecture des tendances : {e}")
+                    trends = pd.DataFrame()
+                if trends.empty:
+                    st.info("Aucune tendance enregistrée pour ces mots-clés.")
+                else:
+                    fig = px.line(
+                        downsample_line(trends, "date", "score_tendance", color="mot_cle"),
+                        x="date",
+                        y="score_tendance",
+                        color="mot_cle",
+                        title="Intérêt de recherche",
+                    )
+                    fig.update_layout(height=320, margin=dict(t=40, l=10, r=10, b=10))
+                    show_chart(fig)
     with col2:
         st.image(
             IMAGES["prediction"],
@@ -1446,7 +1853,21 @@ def render_authenticated_area():
     }
     renderers.get(page, render_home_page)()
 
+    with st.sidebar.expander("🔌 Pool de connexions"):
+        metrics = get_pool_metrics()
+        served = metrics["exhausted"] - metrics["timeouts"]  # attentes terminées par une connexion
+        avg_wait = metrics["wait_seconds"] / served if served > 0 else 0.0
+        st.caption(
+            f"{metrics['pool_size']} connexions · {metrics['checkouts']:,} emprunts · "
+            f"{metrics['exhausted']:,} saturations (attente moy. {avg_wait:.2f} s) · "
+            f"{metrics['timeouts']:,} expirations · {metrics['reconnects']:,} reconnexions"
+        )
+
     if st.sidebar.button("Se déconnecter"):
+        service = _auth_service()
+        service["executor"].submit(_flush_last_logins, service)
+        release_session_dataset()
+        discard_pending_export()
         st.session_state.is_authenticated = False
         st.session_state.user_email = ""
         st.experimental_set_query_params()
@@ -1469,7 +1890,8 @@ def render_auth_forms():
                 if not email or not password:
                     st.error("Veuillez remplir tous les champs.")
                 else:
-                    user_email = verify_credentials(email, password)
+                    with st.spinner("Vérification des identifiants…"):
+                        user_email = verify_credentials(email, password)
                     if user_email:
                         st.session_state.is_authenticated = True
                         st.session_state.user_email = user_email
@@ -1508,3 +1930,7 @@ def main():
 
 if __name__ == "__main__":
     main()
+
+
+if __name__ == "__main__":
+    main()
@@ -25,6 +25,21 @@ CREATE TABLE user_datasets (
     FOREIGN KEY (user_id) REFERENCES users(user_id)
 );
 
+-- Table des ventes (lignes chargées depuis les datasets téléversés)
+CREATE TABLE ventes (
+    vente_id BIGINT PRIMARY KEY AUTO_INCREMENT,
+    dataset_id INT NOT NULL,
+    date_vente DATE NOT NULL,
+    produit VARCHAR(100) NOT NULL,
+    categorie VARCHAR(50),
+    zone VARCHAR(50),
+    quantite DECIMAL(12,2) NOT NULL,
+    prix_unitaire DECIMAL(12,2),
+    cout_unitaire DECIMAL(12,2),
+    stock INT,
+    FOREIGN KEY (dataset_id) REFERENCES user_datasets(dataset_id)
+);
+
 -- Table météo
 CREATE TABLE meteo (
     meteo_id INT PRIMARY KEY AUTO_INCREMENT,
@@ -71,20 +86,25 @@ CREATE TABLE predictions (
     precision_prediction DECIMAL(5,2),
     zone VARCHAR(50),
     produit VARCHAR(100),
+    version_modele VARCHAR(50),
+    horizon_jours INT,
     FOREIGN KEY (dataset_id) REFERENCES user_datasets(dataset_id)
 );
 
 -- Index pour optimiser les requêtes
+CREATE INDEX idx_ventes_dataset_date ON ventes(dataset_id, date_vente);
 CREATE INDEX idx_ventes_date ON ventes(date_vente);
 CREATE INDEX idx_ventes_produit ON ventes(produit);
 CREATE INDEX idx_ventes_zone ON ventes(zone);
 CREATE INDEX idx_meteo_date ON meteo(date);
 CREATE INDEX idx_tendances_date ON tendances(date);
 CREATE INDEX idx_predictions_date ON predictions(date_cible);
+CREATE INDEX idx_predictions_cache ON predictions(dataset_id, version_modele, horizon_jours);
 
 -- Vues pour faciliter les analyses
 CREATE VIEW v_ventes_quotidiennes AS
 SELECT 
+    dataset_id,
     date_vente,
     zone,
     COUNT(*) as nb_ventes,
@@ -92,10 +112,11 @@ SELECT
     SUM(quantite * prix_unitaire) as chiffre_affaires,
     SUM(quantite * (prix_unitaire - COALESCE(cout_unitaire, 0))) as benefice
 FROM ventes
-GROUP BY date_vente, zone;
+GROUP BY dataset_id, date_vente, zone;
 
 CREATE VIEW v_performance_produits AS
 SELECT 
+    v.dataset_id,
     v.produit,
     v.categorie,
     COUNT(DISTINCT v.date_vente) as jours_vente,
@@ -104,4 +125,4 @@ SELECT
     SUM(v.quantite * v.prix_unitaire) as ca_total,
     SUM(v.quantite * (v.prix_unitaire - COALESCE(v.cout_unitaire, 0))) as benefice_total
 FROM ventes v
-GROUP BY v.produit, v.categorie;
\ No newline at end of file
+GROUP BY v.dataset_id, v.produit, v.categorie;
\ No newline at end of file
@@ -0,0 +1,2471 @@
+"""Moteur de données de Smart Market : ingestion, index, agrégats, prévisions et exports."""
+import gzip
+import hashlib
+import json
+import logging
+import os
+import re
+import tempfile
+import threading
+import time
+import weakref
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+from datetime import datetime
+import joblib
+from mysql.connector import Error, pooling
+from mysql.connector.errors import PoolError
+import numpy as np
+import pandas as pd
+from pandas.tseries.api import guess_datetime_format
+import pyarrow as pa
+import pyarrow.dataset as pads
+import pyarrow.parquet as pq
+from openpyxl import Workbook, load_workbook
+import streamlit as st
+from xgboost import XGBRegressor
+
+_CURRENT_DIR = Path(__file__).resolve().parent
+
+if int(pd.__version__.split(".")[0]) < 3:
+    # Copy-on-Write (par défaut depuis pandas 3) : les DataFrames partagés entre
+    # sessions ne sont jamais modifiés par les vues qui en dérivent.
+    pd.set_option("mode.copy_on_write", True)
+
+DB_CONFIG = {
+    "host": "localhost",
+    "user": "root",
+    "password": "",  # Remplacez par votre mot de passe MySQL
+    "database": "smart_market",
+}
+
+DB_POOL_NAME = "smart_market_pool"
+DB_POOL_SIZE = 8  # connexions ouvertes en permanence (max 32 côté mysql-connector)
+DB_POOL_TIMEOUT = 5.0  # secondes d'attente max quand le pool est saturé
+BULK_BATCH_ROWS = 5_000  # lignes par INSERT multi-valeurs
+VENTES_COLUMNS = ["date_vente", "produit", "categorie", "zone", "quantite", "prix_unitaire", "cout_unitaire", "stock"]
+TRENDS_BATCH_KEYWORDS = 5  # limite de Google Trends par requête
+TRENDS_MIN_INTERVAL = 2.0  # secondes minimum entre deux appels réseau
+TRENDS_OVERLAP_DAYS = 7  # jours refetchés pour recaler les scores d'une mise à jour incrémentale
+TRENDS_HISTORY_DAYS = 365
+TRENDS_GEO = "GN"
+TRENDS_FIXTURE_DIR = _CURRENT_DIR / "data" / "trends"  # <mot_cle>.csv (date, score_tendance) pour le mode hors ligne
+HOLIDAY_COUNTRY = "GN"  # calendrier officiel du package `holidays`, complété par la table jours_feries
+HOLIDAY_TYPES = ("national", "local", "religieux")  # codes 1, 2, 3 ; 0 = jour ordinaire
+HOLIDAY_RELIGIOUS_KEYWORDS = ("Pâques", "Aïd", "Tabaski", "Maoloud", "Lailatoul", "Noël", "Assomption", "Ascension", "Pentecôte", "Toussaint")
+HOLIDAY_DISTANCE_CAP = 60  # distance (jours) au férié le plus proche au-delà de laquelle on sature
+WEATHER_COLUMNS = ["temperature", "precipitation", "humidite"]
+WEATHER_TOLERANCE_DAYS = 3  # écart maximal entre une vente et le relevé météo retenu
+WEATHER_CACHE_SIZE = 16
+WEATHER_MIN_POINTS = 30  # couples jour × zone minimum pour signaler une corrélation météo
+MODEL_STORE_DIR = _CURRENT_DIR / "data" / "models"
+MODEL_VERSION = "prophet-2"
+FORECAST_HORIZONS = {"1 semaine": 7, "1 mois": 30, "3 mois": 90}
+FORECAST_MIN_HISTORY = 14  # jours observés minimum pour entraîner un modèle dédié à une série
+FORECAST_BATCH_SERIES = 25  # séries entraînées par tâche envoyée à un worker
+FORECAST_WORKERS = max(1, (os.cpu_count() or 2) - 1)
+FORECAST_INTERVAL_WIDTH = 0.8
+FORECAST_ENGINES = {"xgboost": "Global multi-séries (XGBoost)", "prophet": "Par série (Prophet)"}
+GLOBAL_MODEL_VERSION = "xgb-global-3"
+ENGINE_VERSIONS = {"xgboost": GLOBAL_MODEL_VERSION, "prophet": MODEL_VERSION}
+FORECAST_CACHE_SIZE = 64
+PRECOMPUTE_ENGINE = "xgboost"  # moteur utilisé pour précalculer les horizons après un téléversement
+GLOBAL_LAGS = (1, 7, 14, 28)
+GLOBAL_WINDOWS = (7, 28)
+GLOBAL_TRAIN_DAYS = 730  # profondeur d'historique utilisée pour un entraînement complet
+GLOBAL_TREES = 300
+GLOBAL_INCREMENTAL_TREES = 100  # arbres ajoutés lors d'un réentraînement incrémental
+# Aucun historique de dépenses marketing n'est disponible : l'effet d'un budget est
+# modélisé par une courbe de saturation (lift_max × budget / (budget + demi_saturation))
+# répartie sur l'horizon selon le profil du scénario, au-dessus de la prévision de base.
+SCENARIOS = {
+    "Tendance actuelle": {"lift_max": 0.0, "demi_saturation": 1.0, "profil": "plat"},
+    "Campagne marketing": {"lift_max": 0.25, "demi_saturation": 60_000.0, "profil": "campagne"},
+    "Nouveau produit": {"lift_max": 0.40, "demi_saturation": 90_000.0, "profil": "lancement"},
+}
+BUDGET_MIN, BUDGET_MAX, BUDGET_STEP = 10_000, 150_000, 5_000
+BUDGET_GRID = np.arange(BUDGET_MIN, BUDGET_MAX + BUDGET_STEP, BUDGET_STEP, dtype=np.float64)
+QUERY_BACKENDS = {
+    "session": "Session (pandas)",
+    "mysql": "Base MySQL (agrégats SQL)",
+}
+
+MAX_UPLOAD_BYTES = 1_000_000_000  # 1 Go
+MAX_UPLOAD_MB = MAX_UPLOAD_BYTES // (1024 * 1024)
+INGEST_CHUNK_ROWS = 100_000  # lignes lues par bloc lors de l'ingestion
+NUMERIC_INFERENCE_RATIO = 0.95  # part minimale de valeurs numériques pour typer une colonne texte
+DATE_INFERENCE_RATIO = 0.95  # part minimale de dates valides pour typer une colonne texte en date
+CATEGORY_MAX_RATIO = 0.5  # au-delà de cette part de valeurs distinctes, un texte reste une chaîne
+DATASET_STORE_DIR = _CURRENT_DIR / "data" / "datasets"
+PARQUET_COMPRESSION = "zstd"
+DATASET_MEMORY_BUDGET = 4 * 1024**3  # octets de DataFrames gardés en mémoire, toutes sessions confondues
+DETECTION_CACHE_SIZE = 16
+ROLLUP_CACHE_SIZE = 16
+ANALYTICS_CACHE_SIZE = 16
+FILTER_CACHE_SIZE = 16
+TIME_SERIES_CACHE_SIZE = 16
+QUALITY_CACHE_SIZE = 16
+EXPLORER_PAGE_SIZES = [25, 50, 100, 250, 500]
+EXPLORER_CACHE_SIZE = 8
+CHART_MAX_POINTS = 1_500  # points par courbe après sous-échantillonnage LTTB
+CHART_MAX_BARS = 30  # barres affichées avant regroupement dans « Autres »
+CHART_WEBGL_POINTS = 2_000  # au-delà, les nuages de points sont rendus en WebGL
+CHART_MAX_PAYLOAD_BYTES = 1_500_000  # taille JSON maximale envoyée au navigateur par graphique
+QUALITY_IQR_FACTOR = 1.5  # bornes des valeurs aberrantes : [Q1 - k·IQR, Q3 + k·IQR]
+QUALITY_NULL_ALERT = 0.2  # part de valeurs manquantes d'une colonne déclenchant une alerte
+QUALITY_TYPE_ALERT = 0.95  # confiance de typage en dessous de laquelle une colonne est signalée
+QUALITY_OUTLIER_ALERT = 0.01  # part de valeurs aberrantes déclenchant une alerte
+HLL_PRECISION = 12  # 4 096 registres, erreur type ≈ 1,6 %
+
+
+@st.cache_resource
+def _get_pool():
+    """Pool de connexions partagé entre les reruns et les sessions Streamlit."""
+    return pooling.MySQLConnectionPool(
+        pool_name=DB_POOL_NAME,
+        pool_size=DB_POOL_SIZE,
+        pool_reset_session=True,
+        **DB_CONFIG,
+    )
+
+
+@st.cache_resource
+def _pool_metrics():
+    return {
+        "lock": threading.Lock(),
+        "checkouts": 0,
+        "reconnects": 0,
+        "exhausted": 0,
+        "timeouts": 0,
+        "wait_seconds": 0.0,
+    }
+
+
+def _record_pool_metric(name, increment=1):
+    metrics = _pool_metrics()
+    with metrics["lock"]:
+        metrics[name] += increment
+
+
+def get_pool_metrics():
+    """Instantané des compteurs du pool (checkouts, saturations, reconnexions)."""
+    metrics = _pool_metrics()
+    with metrics["lock"]:
+        snapshot = {k: v for k, v in metrics.items() if k != "lock"}
+    snapshot["pool_size"] = DB_POOL_SIZE
+    return snapshot
+
+
+def _get_connection(timeout=DB_POOL_TIMEOUT):
+    """Retourne une connexion MySQL issue du pool ou lève une erreur."""
+    pool = _get_pool()
+    started = time.monotonic()
+    exhausted = False
+    while True:
+        try:
+            connection = pool.get_connection()
+            break
+        except PoolError:
+            if not exhausted:
+                exhausted = True
+                _record_pool_metric("exhausted")
+            if time.monotonic() - started >= timeout:
+                _record_pool_metric("timeouts")
+                logging.getLogger(__name__).warning("Pool MySQL saturé après %.1f s d'attente : %s", timeout, get_pool_metrics())
+                raise
+            time.sleep(0.05)
+    if exhausted:
+        _record_pool_metric("wait_seconds", time.monotonic() - started)
+    _record_pool_metric("checkouts")
+
+    if not connection.is_connected():
+        _record_pool_metric("reconnects")
+    try:
+        connection.ping(reconnect=True, attempts=2, delay=0)
+    except Error:
+        _release_connection(connection)
+        raise
+    return connection
+
+
+def _release_connection(connection, cursor=None):
+    """Ferme le curseur et rend la connexion au pool, même si la socket est morte."""
+    if cursor is not None:
+        try:
+            cursor.close()
+        except Error:
+            pass
+    if connection is not None:
+        try:
+            connection.close()
+        except Error:
+            pass
+
+
+def _find_column(df, keywords):
+    cols = list(df.columns)
+    lowered = [c.lower() for c in cols]
+    for kw in keywords:
+        for idx, name in enumerate(lowered):
+            if kw in name:
+                return cols[idx]
+    return None
+
+
+def _is_date_like(series: pd.Series, sample=200):
+    if pd.api.types.is_datetime64_any_dtype(series):
+        return True
+    try:
+        values = series.dropna().astype(str)
+        if values.empty:
+            return False
+        sample_values = values.sample(min(len(values), sample), random_state=42)
+        parsed = pd.to_datetime(sample_values, errors="coerce")
+        return parsed.notna().mean() > 0.6
+    except Exception:
+        return False
+
+
+class _LRUCache:
+    """Cache LRU borné et thread-safe, partagé entre les sessions Streamlit."""
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key not in self._entries:
+                return default
+            self._entries.move_to_end(key)
+            return self._entries[key]
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+def dataset_content_hash(df: pd.DataFrame) -> str:
+    """Empreinte exacte du contenu (toutes les lignes) d'un dataset."""
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(repr([(str(col), str(dtype)) for col, dtype in df.dtypes.items()]).encode())
+    digest.update(pd.util.hash_pandas_object(df, index=False).to_numpy().tobytes())
+    return digest.hexdigest()
+
+
+@st.cache_resource
+def _detection_cache():
+    return _LRUCache(DETECTION_CACHE_SIZE)
+
+
+def _infer_sales_columns(df: pd.DataFrame):
+    """Inférence coûteuse des colonnes clés, avec les colonnes dérivées à rattacher au frame."""
+    cols = df.columns
+    date_col = next((c for c in cols if _is_date_like(df[c])), None)
+    revenue_col = _find_column(df, ["revenue", "amount", "total", "sales", "price", "montant"])
+    qty_col = _find_column(df, ["quantity", "qty", "units", "unit", "quantité", "qte"])
+    product_col = _find_column(df, ["product", "item", "sku", "article", "produit"])
+    store_col = _find_column(df, ["store", "shop", "branch", "location", "magasin"])
+    order_col = _find_column(df, ["order_id", "order", "invoice", "transaction", "commande"])
+    customer_col = _find_column(df, ["customer", "client", "buyer", "client_id"])
+
+    derived = {}
+    if revenue_col is None and qty_col:
+        price_col = _find_column(df, ["price", "unit_price", "cost", "prix"])
+        if price_col:
+            try:
+                computed = pd.to_numeric(df[price_col], errors="coerce").astype(np.float64) * pd.to_numeric(
+                    df[qty_col], errors="coerce"
+                ).astype(np.float64)
+                derived["_computed_revenue"] = computed.to_numpy()
+                revenue_col = "_computed_revenue"
+            except Exception:
+                revenue_col = None
+
+    if date_col and not pd.api.types.is_datetime64_any_dtype(df[date_col]):
+        derived[date_col] = pd.to_datetime(df[date_col], errors="coerce").array
+
+    return {
+        "derived": derived,
+        "date_col": date_col,
+        "revenue_col": revenue_col,
+        "qty_col": qty_col,
+        "product_col": product_col,
+        "store_col": store_col,
+        "order_col": order_col,
+        "customer_col": customer_col,
+    }
+
+
+def detect_sales_columns(df: pd.DataFrame, dataset_key):
+    """Détecte les colonnes clés d'un dataset de ventes."""
+    cache = _detection_cache()
+    detected = cache.get(dataset_key)
+    if detected is None:
+        detected = _infer_sales_columns(df)
+        cache.put(dataset_key, detected)
+
+    if detected["derived"]:
+        df = df.copy(deep=False)
+        for col, values in detected["derived"].items():
+            df[col] = values
+
+    result = {k: v for k, v in detected.items() if k != "derived"}
+    result["df"] = df
+    result["dataset_key"] = dataset_key
+    return result
+
+
+class TimeSeriesIndex:
+    """Buckets journaliers d'une mesure, base des séries quotidiennes, hebdo et mensuelles."""
+
+    def __init__(self, date_col, value_col):
+        self.date_col = date_col
+        self.value_col = value_col
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.daily = pd.Series(dtype="float64")
+        self.rows_indexed = 0
+        self.dataset_key = self.digest = None
+        self._series = {}
+
+    def row_hashes(self, df: pd.DataFrame):
+        """Hachage par ligne de (date, mesure), indépendant du typage compacté des colonnes."""
+        rows = pd.DataFrame(
+            {
+                "date": pd.to_datetime(df[self.date_col], errors="coerce"),
+                "valeur": pd.to_numeric(df[self.value_col], errors="coerce").astype(np.float64),
+            }
+        )
+        return pd.util.hash_pandas_object(rows, index=False).to_numpy()
+
+    def append(self, df: pd.DataFrame):
+        subset = df[[self.date_col, self.value_col]].dropna()
+        if not subset.empty:
+            days = pd.to_datetime(subset[self.date_col]).dt.floor("D")
+            buckets = pd.to_numeric(subset[self.value_col], errors="coerce").groupby(days).sum()
+            self.daily = buckets if self.daily.empty else self.daily.add(buckets, fill_value=0).sort_index()
+        self.rows_indexed += len(df)
+        self._series.clear()
+
+    def series(self, freq="D") -> pd.DataFrame:
+        if freq not in self._series:
+            if self.daily.empty:
+                result = pd.DataFrame()
+            else:
+                daily = self.daily
+                if freq != "D":
+                    daily = daily.groupby(daily.index.to_period(freq).start_time).sum()
+                result = daily.rename_axis("date").rename(self.value_col).reset_index()
+            self._series[freq] = result
+        return self._series[freq]
+
+
+@st.cache_resource
+def _time_series_cache():
+    return _LRUCache(TIME_SERIES_CACHE_SIZE)
+
+
+def _digest(hashes) -> str:
+    return hashlib.blake2b(hashes.tobytes(), digest_size=16).hexdigest()
+
+
+def compute_time_series(df: pd.DataFrame, date_col: str, value_col: str, freq="D", dataset_key=None, lineage=None):
+    """Série temporelle agrégée (D, W ou M) servie par un index journalier partagé par lignée de datasets."""
+    if dataset_key is None:
+        index = TimeSeriesIndex(date_col, value_col)
+        index.append(df)
+        return index.series(freq)
+    key = (lineage or dataset_key, date_col, value_col)
+    cache = _time_series_cache()
+    index = cache.get(key)
+    if index is None:
+        index = TimeSeriesIndex(date_col, value_col)
+        cache.put(key, index)
+
+    with index.lock:
+        if index.dataset_key != dataset_key:
+            # Nouveau contenu dans la lignée : seules les lignes au-delà d'un préfixe inchangé sont agrégées.
+            hashes = index.row_hashes(df)
+            indexed = index.rows_indexed
+            if indexed and (len(hashes) < indexed or _digest(hashes[:indexed]) != index.digest):
+                index.reset()
+            index.append(df.iloc[index.rows_indexed:])
+            index.dataset_key, index.digest = dataset_key, _digest(hashes)
+        return index.series(freq)
+
+
+# ------------------ Rendu des graphiques (taille des payloads) -------------
+def lttb_indices(x, y, threshold):
+    """Indices retenus par Largest-Triangle-Three-Buckets pour tracer `threshold` points."""
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    edges = np.linspace(1, n - 1, threshold - 1).astype(np.intp)
+    selected = np.empty(threshold, dtype=np.intp)
+    selected[0], selected[-1] = 0, n - 1
+    previous = 0
+    for i in range(threshold - 2):
+        start, end = edges[i], max(edges[i + 1], edges[i] + 1)
+        next_start, next_end = end, edges[i + 2] if i + 2 < len(edges) else n
+        next_x = x[next_start:max(next_end, next_start + 1)].mean()
+        next_y = y[next_start:max(next_end, next_start + 1)].mean()
+        area = np.abs(
+            (x[previous] - next_x) * (y[start:end] - y[previous]) - (x[previous] - x[start:end]) * (next_y - y[previous])
+        )
+        previous = start + int(np.nanargmax(area)) if not np.isnan(area).all() else start
+        selected[i + 1] = previous
+    return selected
+
+
+def downsample_line(frame: pd.DataFrame, x, y, color=None, max_points=CHART_MAX_POINTS) -> pd.DataFrame:
+    """Sous-échantillonne chaque courbe de `frame` (une par valeur de `color`) à `max_points` points."""
+    if len(frame) <= max_points:
+        return frame
+    groups = [frame] if color is None else [g for _, g in frame.groupby(color, observed=True, sort=False)]
+    parts = []
+    for group in groups:
+        group = group.sort_values(x)
+        xs = group[x].to_numpy()
+        xs = xs.astype("datetime64[ns]").astype(np.int64) if np.issubdtype(xs.dtype, np.datetime64) else xs
+        parts.append(group.iloc[lttb_indices(xs, group[y].to_numpy(dtype=np.float64, na_value=np.nan), max_points)])
+    return pd.concat(parts, ignore_index=True)
+
+
+def top_k_with_others(values: pd.Series, k=CHART_MAX_BARS, others_label="Autres") -> pd.Series:
+    """Les `k` plus grandes valeurs, le reste étant cumulé dans une barre « Autres »."""
+    ordered = values.sort_values(ascending=False)
+    if len(ordered) <= k:
+        return ordered
+    top = ordered.head(k)
+    top.index = top.index.astype(str)
+    rest = pd.Series([ordered.iloc[k:].sum()], index=[f"{others_label} ({len(ordered) - k:,})"])
+    return pd.concat([top, rest]).rename_axis(values.index.name).rename(values.name)
+
+
+def scatter_render_mode(n_points):
+    """Rendu WebGL (scattergl) pour les grands nuages de points, SVG sinon."""
+    return "webgl" if n_points > CHART_WEBGL_POINTS else "svg"
+
+
+# ------------------ Agrégats pré-calculés du dashboard --------------------
+class HyperLogLog:
+    """Sketch HyperLogLog vectorisé pour estimer un nombre de valeurs distinctes."""
+
+    def __init__(self, precision=HLL_PRECISION):
+        self.precision = precision
+        self.registers = np.zeros(1 << precision, dtype=np.uint8)
+
+    def add(self, values: pd.Series):
+        values = values.dropna()
+        if values.empty:
+            return
+        p = self.precision
+        hashes = pd.util.hash_pandas_object(values, index=False).to_numpy(dtype=np.uint64)
+        buckets = (hashes >> np.uint64(64 - p)).astype(np.int64)
+        remainder = hashes & np.uint64((1 << (64 - p)) - 1)
+        _, bit_length = np.frexp(remainder.astype(np.float64))
+        ranks = ((64 - p) - bit_length + 1).astype(np.uint8)
+        best = pd.Series(ranks).groupby(buckets).max()
+        idx = best.index.to_numpy()
+        self.registers[idx] = np.maximum(self.registers[idx], best.to_numpy())
+
+    def merge(self, other: "HyperLogLog"):
+        np.maximum(self.registers, other.registers, out=self.registers)
+
+    def count(self) -> int:
+        m = self.registers.size
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / np.sum(np.exp2(-self.registers.astype(np.float64)))
+        zeros = int(np.count_nonzero(self.registers == 0))
+        if estimate <= 2.5 * m and zeros:
+            estimate = m * np.log(m / zeros)
+        return int(round(estimate))
+
+
+@st.cache_resource
+def _rollup_cache():
+    return _LRUCache(ROLLUP_CACHE_SIZE)
+
+
+def _build_sales_rollup(detected):
+    df = detected["df"]
+    date_col = detected["date_col"]
+    revenue_col = detected["revenue_col"]
+    qty_col = detected["qty_col"]
+
+    columns = {}
+    dims = []
+    if date_col:
+        columns["jour"] = df[date_col].dt.floor("D")
+        dims.append("jour")
+    for col in (detected["product_col"], detected["store_col"]):
+        if col and col not in columns:
+            columns[col] = df[col]
+            dims.append(col)
+    measures = {"nb_lignes": ("nb_lignes", "sum")}
+    columns["nb_lignes"] = np.ones(len(df), dtype=np.int64)
+    for col in (revenue_col, qty_col):
+        if col and col not in columns:
+            columns[col] = pd.to_numeric(df[col], errors="coerce")
+            measures[col] = (col, "sum")
+
+    frame = pd.DataFrame(columns, index=df.index)
+    if dims:
+        cube = frame.groupby(dims, dropna=False, observed=True, sort=False).agg(**measures).reset_index()
+    else:
+        cube = frame[list(measures)].sum().to_frame().T
+
+    sketches = {}
+    for name in ("order_col", "customer_col"):
+        if detected[name]:
+            sketch = HyperLogLog()
+            sketch.add(df[detected[name]])
+            sketches[name] = sketch
+
+    n_rows, n_cols = df.shape
+    return {
+        "cube": cube,
+        "sketches": sketches,
+        "n_rows": n_rows,
+        "n_cols": n_cols,
+    }
+
+
+def sales_rollup(detected):
+    """Cube jour × produit × magasin (sommes et comptages) et sketches de distincts."""
+    cache = _rollup_cache()
+    rollup = cache.get(detected["dataset_key"])
+    if rollup is None:
+        rollup = _build_sales_rollup(detected)
+        cache.put(detected["dataset_key"], rollup)
+    return rollup
+
+
+# ------------ Helpers spécifiques à l'analyse produits --------------------
+SEUIL_STOCK_BAS = 10
+SEUIL_MARGE_CRITIQUE = 15  # pourcentage
+TOP_N = 10
+EXPORT_CHUNK_ROWS = 50_000  # lignes écrites par bloc dans les fichiers exportés
+REPORT_COLUMNS = {
+    "Rapport complet": ["Produit", "Ventes_Totales", "CA_Total", "Marge_Totale", "Stock_Actuel", "Date_Export"],
+    "Synthèse performance": ["Produit", "Ventes_Totales", "CA_Total", "Marge_Totale", "Date_Export"],
+    "Analyse stock": ["Produit", "Stock_Actuel", "Ventes_Totales", "Date_Export"],
+}
+EXPORT_FORMATS = {
+    "CSV": ("csv", "text/csv"),
+    "CSV compressé (gzip)": ("csv.gz", "application/gzip"),
+    "XLSX": ("xlsx", "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"),
+}
+XLSX_MAX_ROWS = 1_048_575  # lignes de données par feuille Excel (hors en-tête)
+
+PRODUCT_COLUMN_MAP = {
+    "product": "produit",
+    "product_name": "produit",
+    "item": "produit",
+    "name": "produit",
+    "quantity": "quantite",
+    "qty": "quantite",
+    "amount": "quantite",
+    "price": "prix_unitaire",
+    "unit_price": "prix_unitaire",
+    "prix_unitaire": "prix_unitaire",
+    "cost": "cout_unitaire",
+    "cost_unit": "cout_unitaire",
+    "unit_cost": "cout_unitaire",
+    "stock": "stock",
+    "inventory": "stock",
+    "date": "date",
+    "date_vente": "date",
+    "sale_date": "date",
+    "categorie": "categorie",
+    "category": "categorie",
+    "zone": "zone",
+    "region": "zone",
+}
+
+
+def _product_column_key(col) -> str:
+    return str(col).strip().lower().replace(" ", "_")
+
+
+def product_source_columns(columns):
+    """Colonnes brutes utiles à l'analyse produits (celles que la normalisation reconnaît)."""
+    targets = set(PRODUCT_COLUMN_MAP.values())
+    return [c for c in columns if _product_column_key(c) in PRODUCT_COLUMN_MAP or c in targets]
+
+
+def normalize_product_columns(df: pd.DataFrame) -> pd.DataFrame:
+    mapping = {}
+    for col in df.columns:
+        key = _product_column_key(col)
+        if key in PRODUCT_COLUMN_MAP:
+            mapping[col] = PRODUCT_COLUMN_MAP[key]
+    if mapping:
+        df = df.rename(columns=mapping)
+    if "date" in df.columns:
+        try:
+            df["date"] = pd.to_datetime(df["date"])
+        except Exception:
+            pass
+    return df
+
+
+def calculate_product_metrics(df: pd.DataFrame, totals=None):
+    """KPIs produits ; `totals` (sommes déjà calculées par le plan d'agrégation) évite de les recalculer."""
+    if totals is None:
+        totals = _analytics_measures(df).sum()
+    metrics = {}
+    if all(c in df.columns for c in ["quantite", "prix_unitaire"]):
+        metrics["ventes"] = totals["quantite"]
+        metrics["ca"] = totals["ca"]
+        if "marge" in totals:
+            metrics["marge"] = totals["marge"]
+            metrics["taux_marge"] = (metrics["marge"] / metrics["ca"]) * 100 if metrics["ca"] else 0
+    if "stock" in df.columns:
+        metrics["stock_total"] = totals["stock"]
+        metrics["produits_stock_bas"] = int((df["stock"] < SEUIL_STOCK_BAS).sum())
+    return metrics
+
+
+def _analytics_measures(df: pd.DataFrame) -> pd.DataFrame:
+    """Mesures de base et colonnes dérivées (CA, marge), calculées une seule fois."""
+    # En float64 : les colonnes compactées (entiers courts, float32) déborderaient ou perdraient en précision.
+    values = {
+        col: df[col].astype(np.float64)
+        for col in ("quantite", "prix_unitaire", "cout_unitaire", "stock")
+        if col in df.columns and pd.api.types.is_numeric_dtype(df[col])
+    }
+    measures = {col: values[col] for col in ("quantite", "prix_unitaire", "stock") if col in values}
+    if all(c in values for c in ("quantite", "prix_unitaire")):
+        measures["ca"] = values["quantite"] * values["prix_unitaire"]
+        if "cout_unitaire" in values and values["cout_unitaire"].notna().any():
+            measures["marge"] = (values["prix_unitaire"] - values["cout_unitaire"]) * values["quantite"]
+    return pd.DataFrame(measures, index=df.index)
+
+
+class FilterIndex:
+    """Index de filtrage de la page Analytics, construit une fois par dataset."""
+
+    def __init__(self, df: pd.DataFrame):
+        self.n_rows = len(df)
+        self.codes, self.values = {}, {}
+        for col in ("categorie", "produit"):
+            if col in df.columns:
+                codes, uniques = pd.factorize(df[col], sort=True)
+                self.codes[col], self.values[col] = codes, pd.Index(uniques)
+        self.date_order = self.sorted_dates = None
+        if "date" in df.columns:
+            dates = pd.to_datetime(df["date"], errors="coerce").to_numpy(dtype="datetime64[ns]")
+            valid = np.flatnonzero(~np.isnat(dates))
+            self.date_order = valid[np.argsort(dates[valid], kind="stable")]
+            self.sorted_dates = dates[self.date_order]
+        self._options = {}
+        self._lock = threading.Lock()
+
+    def date_bounds(self):
+        if self.sorted_dates is None or not len(self.sorted_dates):
+            return None
+        return pd.Timestamp(self.sorted_dates[0]), pd.Timestamp(self.sorted_dates[-1])
+
+    def options(self, col, categorie=None):
+        """Valeurs distinctes triées de `col`, restreintes à une catégorie si précisé."""
+        key = (col, categorie)
+        with self._lock:
+            if key not in self._options:
+                codes = self.codes.get(col)
+                if codes is None:
+                    self._options[key] = []
+                else:
+                    if categorie is not None and "categorie" in self.codes:
+                        codes = codes[self._value_mask("categorie", [categorie])]
+                    present = np.unique(codes[codes >= 0])
+                    self._options[key] = self.values[col][present].tolist()
+            return self._options[key]
+
+    def _value_mask(self, col, selected):
+        lookup = np.zeros(len(self.values[col]) + 1, dtype=bool)  # dernier élément : valeurs manquantes (code -1)
+        positions = self.values[col].get_indexer(list(selected))
+        lookup[positions[positions >= 0]] = True
+        return lookup[self.codes[col]]
+
+    def mask(self, start=None, end=None, categorie=None, produits=None):
+        """Masque booléen des lignes retenues, ou None si aucun filtre ne s'applique."""
+        masks = []
+        if self.sorted_dates is not None and start is not None and end is not None:
+            lo = np.searchsorted(self.sorted_dates, np.datetime64(pd.Timestamp(start), "ns"), side="left")
+            hi = np.searchsorted(self.sorted_dates, np.datetime64(pd.Timestamp(end), "ns"), side="right")
+            if lo > 0 or hi < self.n_rows:
+                date_mask = np.zeros(self.n_rows, dtype=bool)
+                date_mask[self.date_order[lo:hi]] = True
+                masks.append(date_mask)
+        if categorie is not None and "categorie" in self.codes:
+            masks.append(self._value_mask("categorie", [categorie]))
+        if produits and "produit" in self.codes:
+            masks.append(self._value_mask("produit", produits))
+        if not masks:
+            return None
+        return np.logical_and.reduce(masks) if len(masks) > 1 else masks[0]
+
+    def apply(self, df: pd.DataFrame, **filters) -> pd.DataFrame:
+        mask = self.mask(**filters)
+        return df if mask is None else df[mask]
+
+
+@st.cache_resource
+def _filter_cache():
+    return _LRUCache(FILTER_CACHE_SIZE)
+
+
+def filter_index(df: pd.DataFrame, dataset_key) -> FilterIndex:
+    """Index de filtrage du dataset, construit une fois par `dataset_key`."""
+    cache = _filter_cache()
+    index = cache.get(dataset_key)
+    if index is None:
+        index = FilterIndex(df)
+        cache.put(dataset_key, index)
+    return index
+
+
+@st.cache_resource
+def _analytics_cache():
+    return _LRUCache(ANALYTICS_CACHE_SIZE)
+
+
+def build_analytics_plan(df: pd.DataFrame, plan_key=None):
+    """Agrégats partagés par les KPIs et les quatre onglets de la page Analytics."""
+    cache = _analytics_cache()
+    plan = cache.get(plan_key) if plan_key is not None else None
+    if plan is not None:
+        return plan
+
+    measures = _analytics_measures(df)
+    aggregations = {
+        col: (col, "mean" if col == "prix_unitaire" else "sum") for col in measures.columns
+    }
+    if aggregations:
+        by_product = measures.groupby(df["produit"], observed=True).agg(**aggregations)
+    else:
+        # Aucune mesure numérique (produit et catégorie seuls) : plan vide, produits sans colonnes.
+        by_product = pd.DataFrame(index=pd.Index(pd.unique(df["produit"].dropna())))
+    by_product.index.name = "produit"
+
+    monthly = pd.DataFrame()
+    if "quantite" in measures.columns and "date" in df.columns and pd.api.types.is_datetime64_any_dtype(df["date"]):
+        monthly_aggs = {k: v for k, v in aggregations.items() if k in ("quantite", "prix_unitaire")}
+        monthly = measures.groupby(df["date"].dt.to_period("M")).agg(**monthly_aggs).reset_index()
+        monthly["date"] = monthly["date"].dt.to_timestamp()
+
+    plan = {
+        "by_product": by_product,
+        "monthly": monthly,
+        "metrics": calculate_product_metrics(df, measures.sum()),
+        "n_products": len(by_product),
+    }
+    if plan_key is not None:
+        cache.put(plan_key, plan)
+    return plan
+
+
+def build_product_report(df: pd.DataFrame, report_type="Rapport complet") -> pd.DataFrame:
+    """Rapport par produit calculé en un seul groupby sur des mesures vectorisées."""
+    # En float64, une valeur manquante comptant pour 0 (comme COALESCE dans `query_product_report`).
+    values = {
+        col: df[col].astype(np.float64)
+        for col in ("quantite", "prix_unitaire", "cout_unitaire", "stock")
+        if col in df.columns and pd.api.types.is_numeric_dtype(df[col])
+    }
+    costed = values["cout_unitaire"].notna() if "cout_unitaire" in values else False
+    values = {col: series.fillna(0) for col, series in values.items()}
+    qty, price = values.get("quantite", 0), values.get("prix_unitaire", 0)
+    measures = pd.DataFrame(
+        {
+            "Ventes_Totales": qty,
+            "CA_Total": qty * price,
+            "Marge_Totale": (price - values["cout_unitaire"]) * qty if "cout_unitaire" in values and "prix_unitaire" in values else 0,
+            "Stock_Actuel": values.get("stock", 0),
+            "couts_connus": costed,
+        },
+        index=df.index,
+    )
+    report = measures.groupby(df["produit"], observed=True, sort=True).sum()
+    # Sans aucun coût unitaire renseigné, la marge est inconnue (et non égale au CA).
+    report["Marge_Totale"] = report["Marge_Totale"].where(report.pop("couts_connus") > 0)
+    report.index.name = "Produit"
+    report = report.reset_index()
+    report["Date_Export"] = datetime.now().strftime("%Y-%m-%d %H:%M")
+    return report[REPORT_COLUMNS[report_type]]
+
+
+def write_chunks_to_file(chunks, fmt="CSV", total_rows=None, on_progress=None) -> Path:
+    """Écrit une suite de blocs (DataFrames) dans un fichier temporaire et retourne son chemin."""
+    suffix, _ = EXPORT_FORMATS[fmt]
+    with tempfile.NamedTemporaryFile(prefix="smartmarket_", suffix=f".{suffix}", delete=False) as handle:
+        path = Path(handle.name)
+    written = 0
+    if fmt == "XLSX":
+        workbook = Workbook(write_only=True)
+        sheet, sheet_rows = None, XLSX_MAX_ROWS
+        for block in chunks:
+            values = block.astype(object)
+            for row in values.where(values.notna(), None).itertuples(index=False, name=None):
+                if sheet_rows >= XLSX_MAX_ROWS:
+                    sheet, sheet_rows = workbook.create_sheet(), 0
+                    sheet.append([str(c) for c in block.columns])
+                sheet.append(row)
+                sheet_rows += 1
+            written += len(block)
+            if on_progress and total_rows:
+                on_progress(min(1.0, written / total_rows))
+        if sheet is None:
+            workbook.create_sheet()
+        workbook.save(path)
+    else:
+        opener = gzip.open if suffix.endswith(".gz") else open
+        with opener(path, "wt", encoding="utf-8", newline="") as out:
+            for block in chunks:
+                block.to_csv(out, index=False, header=written == 0)
+                written += max(1, len(block))
+                if on_progress and total_rows:
+                    on_progress(min(1.0, written / total_rows))
+    return path
+
+
+def write_frame_to_file(frame: pd.DataFrame, fmt="CSV", chunk_rows=EXPORT_CHUNK_ROWS, on_progress=None) -> Path:
+    """Écrit `frame` bloc par bloc dans un fichier temporaire et retourne son chemin."""
+    chunks = (frame.iloc[start:start + chunk_rows] for start in range(0, max(1, len(frame)), chunk_rows))
+    return write_chunks_to_file(chunks, fmt, total_rows=len(frame), on_progress=on_progress)
+
+
+# ------------------ Ingestion des fichiers téléversés ---------------------
+def _iter_upload_chunks(uploaded_file, chunk_rows=INGEST_CHUNK_ROWS):
+    """Lit le fichier téléversé par blocs bornés de `chunk_rows` lignes."""
+    uploaded_file.seek(0)
+    if uploaded_file.name.lower().endswith(".xlsx"):
+        workbook = load_workbook(uploaded_file, read_only=True, data_only=True)
+        try:
+            rows = workbook.active.iter_rows(values_only=True)
+            header = next(rows, None)
+            if header is None:
+                return
+            columns = [str(c) if c is not None else f"colonne_{i + 1}" for i, c in enumerate(header)]
+            width = len(columns)
+            batch = []
+            for row in rows:
+                batch.append(row[:width])
+                if len(batch) >= chunk_rows:
+                    yield pd.DataFrame.from_records(batch, columns=columns)
+                    batch = []
+            if batch:
+                yield pd.DataFrame.from_records(batch, columns=columns)
+        finally:
+            workbook.close()
+    else:
+        yield from pd.read_csv(uploaded_file, chunksize=chunk_rows)
+
+
+def _infer_column_kind(series: pd.Series):
+    """Type d'une colonne d'après un bloc : "empty", "numeric", "datetime", ("datetime", format) ou "text"."""
+    values = series.dropna()
+    if values.empty:
+        return "empty"
+    if pd.api.types.is_bool_dtype(series):
+        return "text"
+    if pd.api.types.is_datetime64_any_dtype(series):
+        return "datetime"
+    if pd.api.types.is_numeric_dtype(series):
+        return "numeric"
+    if pd.to_numeric(values, errors="coerce").notna().mean() >= NUMERIC_INFERENCE_RATIO:
+        return "numeric"
+    date_format = guess_datetime_format(str(values.iloc[0]))
+    if date_format is not None:
+        dates = pd.to_datetime(values.astype(str), format=date_format, errors="coerce")
+        if dates.notna().mean() >= DATE_INFERENCE_RATIO:
+            return ("datetime", date_format)
+    return "text"
+
+
+def _infer_chunk_schema(chunk: pd.DataFrame):
+    """Déduit du premier bloc le type (numérique, date, texte ou vide) de chaque colonne."""
+    return {col: _infer_column_kind(chunk[col]) for col in chunk.columns}
+
+
+def _kind_fits(series: pd.Series, kind) -> bool:
+    """Vrai si le bloc reste convertible vers `kind` aux mêmes seuils que l'inférence initiale."""
+    values = series.dropna()
+    if values.empty or kind == "text":
+        return True
+    if kind == "numeric":
+        if pd.api.types.is_numeric_dtype(series):
+            return True
+        return pd.to_numeric(values, errors="coerce").notna().mean() >= NUMERIC_INFERENCE_RATIO
+    if pd.api.types.is_datetime64_any_dtype(series):
+        return True
+    date_format = kind[1] if isinstance(kind, tuple) else None
+    dates = pd.to_datetime(values.astype(str) if date_format else values, format=date_format, errors="coerce")
+    return dates.notna().mean() >= DATE_INFERENCE_RATIO
+
+
+def _widen_schema(schema, chunk: pd.DataFrame):
+    """Colonnes du schéma que `chunk` contredit, avec le type élargi qui les remplace."""
+    widened = {}
+    for col, kind in schema.items():
+        if kind == "empty":
+            inferred = _infer_column_kind(chunk[col])
+            if inferred != "empty":
+                widened[col] = inferred
+        elif not _kind_fits(chunk[col], kind):
+            widened[col] = "text"
+    return widened
+
+
+def _as_text(series: pd.Series, kind) -> pd.Series:
+    """Repasse en texte une colonne déjà typée `kind`, au plus près des valeurs lues."""
+    if isinstance(kind, tuple):
+        return series.dt.strftime(kind[1])
+    if kind == "numeric":
+        return series.map(lambda v: None if pd.isna(v) else str(int(v)) if float(v).is_integer() else str(v))
+    return series.map(lambda v: None if pd.isna(v) else str(v))
+
+
+def _restage(path: Path, schema, previous):
+    """Réécrit le Parquet en cours selon le schéma élargi et retourne un writer ouvert à sa suite."""
+    staged = path.with_name(f"{path.name}.elargi")
+    os.replace(path, staged)
+    writer = pq.ParquetWriter(str(path), _arrow_schema(schema), compression=PARQUET_COMPRESSION)
+    source = pq.ParquetFile(str(staged))
+    try:
+        for i in range(source.num_row_groups):
+            block = source.read_row_group(i).to_pandas()
+            for col, kind in previous.items():
+                if kind == "empty":
+                    block = _coerce_chunk(block, {str(col): schema[col]})
+                else:
+                    block[str(col)] = _as_text(block[str(col)], kind)
+            writer.write_table(pa.Table.from_pandas(block, schema=writer.schema, preserve_index=False))
+    except BaseException:
+        writer.close()
+        raise
+    finally:
+        source.close()
+        staged.unlink(missing_ok=True)
+    return writer
+
+
+def _coerce_chunk(chunk: pd.DataFrame, schema, type_stats=None):
+    """Applique le schéma au bloc pour que tous les blocs s'écrivent sans retypage."""
+    for col, kind in schema.items():
+        series = chunk[col]
+        present = int(series.notna().sum()) if type_stats is not None and kind not in ("text", "empty") else None
+        if kind == "empty":
+            chunk[col] = pd.Series(None, index=chunk.index, dtype=object)
+        elif kind == "numeric":
+            if not pd.api.types.is_float_dtype(series):
+                chunk[col] = pd.to_numeric(series, errors="coerce").astype("float64")
+        elif kind == "datetime":
+            if not pd.api.types.is_datetime64_any_dtype(series):
+                chunk[col] = pd.to_datetime(series, errors="coerce")
+        elif isinstance(kind, tuple):
+            chunk[col] = pd.to_datetime(series.astype(str), format=kind[1], errors="coerce").astype("datetime64[ns]")
+        elif pd.api.types.infer_dtype(series, skipna=True) not in ("string", "empty"):
+            chunk[col] = series.astype(object).map(lambda v: v if v is None or isinstance(v, str) or pd.isna(v) else str(v))
+        if present is not None:
+            counts = type_stats.setdefault(col, [0, 0])
+            counts[0] += present
+            counts[1] += int(chunk[col].notna().sum())
+    return chunk
+
+
+def _arrow_schema(schema):
+    types = {"empty": pa.null(), "numeric": pa.float64(), "datetime": pa.timestamp("ns"), "text": pa.string()}
+    return pa.schema([pa.field(str(col), types[kind[0] if isinstance(kind, tuple) else kind]) for col, kind in schema.items()])
+
+
+def _downcast_numeric(series: pd.Series) -> pd.Series:
+    """Plus petit type numérique sans perte : entier si toutes les valeurs le sont, sinon float32 si exact."""
+    values = series.to_numpy(dtype=np.float64, na_value=np.nan)
+    present = values[~np.isnan(values)]
+    if len(present) == len(values) and np.all(np.abs(present) < 2**53) and np.array_equal(present, np.round(present)):
+        return pd.to_numeric(series, downcast="integer")
+    if pd.api.types.is_float_dtype(series) and series.dtype != np.float32:
+        narrowed = values.astype(np.float32)
+        if np.array_equal(narrowed.astype(np.float64), values, equal_nan=True):
+            return pd.Series(narrowed, index=series.index, name=series.name)
+    return series
+
+
+def compact_frame(df: pd.DataFrame):
+    """Compacte les types d'un dataset ingéré ; retourne le frame et son empreinte mémoire avant/après."""
+    before = int(df.memory_usage(index=True, deep=True).sum())
+    columns = {}
+    for col in df.columns:
+        series = df[col]
+        if pd.api.types.is_bool_dtype(series) or isinstance(series.dtype, pd.CategoricalDtype):
+            columns[col] = series
+        elif pd.api.types.is_numeric_dtype(series):
+            columns[col] = _downcast_numeric(series)
+        elif pd.api.types.is_string_dtype(series) and series.nunique(dropna=True) <= CATEGORY_MAX_RATIO * len(series):
+            columns[col] = series.astype("category")
+        else:
+            columns[col] = series
+    compacted = pd.DataFrame(columns, index=df.index)
+    after = int(compacted.memory_usage(index=True, deep=True).sum())
+    return compacted, {"before": before, "after": after}
+
+
+def read_parquet_frame(path) -> pd.DataFrame:
+    """Relit d'un bloc un dataset stocké en Parquet (à l'ingestion ou à sa réouverture)."""
+    arrow_schema = pq.read_schema(str(path))
+    text_cols = [f.name for f in arrow_schema if pa.types.is_string(f.type) or pa.types.is_large_string(f.type)]
+    table = pq.read_table(str(path), read_dictionary=text_cols, memory_map=True)
+    n_rows = table.num_rows
+    df = table.to_pandas(split_blocks=True, self_destruct=True)
+    del table
+    for col in (f.name for f in arrow_schema if pa.types.is_null(f.type)):
+        df[col] = np.nan  # colonne jamais renseignée : numérique vide, comme à la lecture d'un CSV
+    for col in text_cols:
+        categories = df[col].cat.categories
+        if len(categories) > CATEGORY_MAX_RATIO * n_rows:
+            df[col] = df[col].astype(categories.dtype)
+        else:
+            # Catégories triées, comme celles produites par `astype("category")`.
+            df[col] = df[col].cat.set_categories(categories.sort_values())
+    return df
+
+
+def ingest_uploaded_file(uploaded_file, chunk_rows=INGEST_CHUNK_ROWS, on_progress=None, store_path=None, type_stats=None):
+    """Construit le dataset bloc par bloc à partir d'un fichier CSV ou XLSX."""
+    total_bytes = uploaded_file.size or 0
+    if store_path is None:
+        with tempfile.NamedTemporaryFile(prefix="smartmarket_", suffix=".parquet", delete=False) as handle:
+            path = Path(handle.name)
+    else:
+        path = Path(store_path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+    schema = None
+    writer = None
+    n_rows = 0
+    try:
+        for chunk in _iter_upload_chunks(uploaded_file, chunk_rows):
+            n_rows += len(chunk)
+            if schema is None:
+                schema = _infer_chunk_schema(chunk)
+                writer = pq.ParquetWriter(str(path), _arrow_schema(schema), compression=PARQUET_COMPRESSION)
+            else:
+                widened = _widen_schema(schema, chunk)
+                if widened:
+                    previous = {col: schema[col] for col in widened}
+                    schema.update(widened)
+                    writer.close()
+                    writer = None
+                    writer = _restage(path, schema, previous)
+                    if type_stats is not None:
+                        for col, kind in widened.items():
+                            if kind == "text":
+                                type_stats.pop(col, None)
+            chunk = _coerce_chunk(chunk, schema, type_stats)
+            writer.write_table(pa.Table.from_pandas(chunk, schema=writer.schema, preserve_index=False))
+            del chunk
+            if on_progress and total_bytes:
+                on_progress(min(1.0, uploaded_file.tell() / total_bytes))
+        if not n_rows:
+            raise ValueError("le fichier ne contient aucune ligne de données")
+        writer.close()
+        writer = None
+        return read_parquet_frame(path)
+    finally:
+        if writer is not None:
+            writer.close()
+        if store_path is None:
+            path.unlink(missing_ok=True)
+
+
+# ------------------ Profil qualité des datasets ----------------------------
+def _column_kind(series: pd.Series):
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        return "catégorie"
+    if pd.api.types.is_bool_dtype(series):
+        return "booléen"
+    if pd.api.types.is_numeric_dtype(series):
+        return "numérique"
+    if pd.api.types.is_datetime64_any_dtype(series):
+        return "date"
+    return "texte"
+
+
+def profile_dataset(df: pd.DataFrame, type_stats=None):
+    """Profil qualité calculé en une passe à l'ingestion."""
+    n_rows, n_cols = df.shape
+    row_hashes = pd.util.hash_pandas_object(df, index=False).to_numpy()
+    nulls = df.isna().sum()
+    columns = {}
+    for col in df.columns:
+        series = df[col]
+        kind = _column_kind(series)
+        info = {"type": kind, "taux_manquant": float(nulls[col] / n_rows) if n_rows else 0.0, "confiance_type": 1.0}
+        if type_stats and col in type_stats and type_stats[col][0]:
+            info["confiance_type"] = type_stats[col][1] / type_stats[col][0]
+        if kind == "numérique":
+            values = series.to_numpy(dtype=np.float64, na_value=np.nan)
+            if not np.isnan(values).all():
+                q1, q3 = np.nanpercentile(values, [25, 75])
+                spread = QUALITY_IQR_FACTOR * (q3 - q1)
+                info["aberrantes"] = int(((values < q1 - spread) | (values > q3 + spread)).sum())
+        columns[str(col)] = info
+    return {
+        "n_rows": n_rows,
+        "n_cols": n_cols,
+        "missing_cells": int(nulls.sum()),
+        "duplicates": int(n_rows - np.unique(row_hashes).size),
+        "columns": columns,
+    }
+
+
+@st.cache_resource
+def _quality_cache():
+    return _LRUCache(QUALITY_CACHE_SIZE)
+
+
+def _quality_path(dataset_id) -> Path:
+    return DATASET_STORE_DIR / f"{dataset_id}.quality.json"
+
+
+def store_quality_profile(profile, dataset_key, dataset_id=None):
+    """Garde le profil en cache et, pour un dataset historisé, à côté de son Parquet."""
+    _quality_cache().put(dataset_key, profile)
+    if dataset_id is not None:
+        _quality_path(dataset_id).parent.mkdir(parents=True, exist_ok=True)
+        _quality_path(dataset_id).write_text(json.dumps(profile, ensure_ascii=False), encoding="utf-8")
+
+
+def load_quality_profile(dataset_id):
+    path = _quality_path(dataset_id)
+    return json.loads(path.read_text(encoding="utf-8")) if path.exists() else None
+
+
+def dataset_quality(df: pd.DataFrame, dataset_key, dataset_id=None):
+    """Profil qualité du dataset : cache, puis fichier stocké, sinon calcul (sans confiance de typage)."""
+    cache = _quality_cache()
+    profile = cache.get(dataset_key)
+    if profile is None and dataset_id is not None:
+        profile = load_quality_profile(dataset_id)
+    if profile is None:
+        profile = profile_dataset(df)
+    cache.put(dataset_key, profile)
+    return profile
+
+
+def quality_alerts(profile):
+    """Alertes qualité lisibles, de la plus globale à la plus spécifique."""
+    alerts = []
+    if profile["duplicates"]:
+        alerts.append(f"⚠️ {profile['duplicates']:,} lignes dupliquées détectées")
+    columns = profile["columns"]
+    sparse = sorted((info["taux_manquant"], col) for col, info in columns.items() if info["taux_manquant"] > QUALITY_NULL_ALERT)
+    for rate, col in reversed(sparse[-3:]):
+        alerts.append(f"⚠️ Colonne '{col}' : {rate:.0%} de valeurs manquantes")
+    for col, info in columns.items():
+        if info["confiance_type"] < QUALITY_TYPE_ALERT:
+            alerts.append(
+                f"⚠️ Colonne '{col}' ({info['type']}) : {1 - info['confiance_type']:.1%} des valeurs lues n'ont pas pu être converties"
+            )
+    n_rows = max(1, profile["n_rows"])
+    outliers = sorted(
+        (info["aberrantes"], col) for col, info in columns.items() if info.get("aberrantes", 0) / n_rows > QUALITY_OUTLIER_ALERT
+    )
+    for count, col in reversed(outliers[-3:]):
+        alerts.append(f"📌 Colonne '{col}' : {count:,} valeurs aberrantes (hors {QUALITY_IQR_FACTOR} × IQR)")
+    return alerts
+
+
+# ------------------ Stockage colonnaire des datasets ----------------------
+def _dataset_path(dataset_id) -> Path:
+    return DATASET_STORE_DIR / f"{dataset_id}.parquet"
+
+
+def dataset_lineage(email, dataset_name):
+    """Lignée d'un dataset : même utilisateur et même fichier source, d'un téléversement à l'autre."""
+    source = re.sub(r"_\d{8}_\d{6}$", "", dataset_name[:100])  # tronqué comme dans `user_datasets`
+    return "lineage-" + hashlib.blake2b(f"{email}\0{source}".encode("utf-8"), digest_size=8).hexdigest()
+
+
+def register_dataset(email: str, dataset_name: str):
+    """Enregistre le dataset dans `user_datasets` et retourne son identifiant."""
+    connection = cursor = None
+    try:
+        connection = _get_connection()
+        cursor = connection.cursor()
+        cursor.execute(
+            "INSERT INTO user_datasets (user_id, dataset_name, file_path) "
+            "SELECT user_id, %s, '' FROM users WHERE email = %s",
+            (dataset_name[:100], email),
+        )
+        if cursor.rowcount != 1:
+            connection.rollback()
+            return None
+        dataset_id = cursor.lastrowid
+        cursor.execute(
+            "UPDATE user_datasets SET file_path = %s WHERE dataset_id = %s",
+            (str(_dataset_path(dataset_id)), dataset_id),
+        )
+        connection.commit()
+        return dataset_id
+    except Error as e:
+        st.error(f"Erreur lors de l'enregistrement du dataset : {e}")
+        return None
+    finally:
+        _release_connection(connection, cursor)
+
+
+def deactivate_dataset(dataset_id):
+    connection = cursor = None
+    try:
+        connection = _get_connection()
+        cursor = connection.cursor()
+        cursor.execute("UPDATE user_datasets SET is_active = FALSE WHERE dataset_id = %s", (dataset_id,))
+        connection.commit()
+    except Error:
+        pass
+    finally:
+        _release_connection(connection, cursor)
+
+
+def list_user_datasets(email: str):
+    """Retourne les datasets actifs de l'utilisateur, du plus récent au plus ancien."""
+    connection = cursor = None
+    try:
+        connection = _get_connection()
+        cursor = connection.cursor(dictionary=True)
+        cursor.execute(
+            "SELECT d.dataset_id, d.dataset_name, d.file_path, d.upload_date "
+            "FROM user_datasets d JOIN users u ON u.user_id = d.user_id "
+            "WHERE u.email = %s AND d.is_active = TRUE ORDER BY d.upload_date DESC",
+            (email,),
+        )
+        return [row for row in cursor.fetchall() if Path(row["file_path"]).exists()]
+    except Error as e:
+        st.error(f"Erreur lors de la lecture des datasets : {e}")
+        return []
+    finally:
+        _release_connection(connection, cursor)
+
+
+def dataset_columns(dataset_id):
+    """Colonnes du dataset stocké, lues depuis le seul schéma Parquet."""
+    return pq.read_schema(str(_dataset_path(dataset_id))).names
+
+
+def iter_dataset_chunks(dataset_id, columns=None, chunk_rows=INGEST_CHUNK_ROWS):
+    """Parcourt le dataset stocké par blocs, sans le charger entièrement."""
+    parquet = pq.ParquetFile(str(_dataset_path(dataset_id)), memory_map=True)
+    for batch in parquet.iter_batches(batch_size=chunk_rows, columns=list(columns) if columns else None):
+        yield batch.to_pandas()
+
+
+# ------------------ Registre partagé des datasets en mémoire --------------
+@st.cache_resource
+def _dataset_registry():
+    return {"lock": threading.Lock(), "entries": OrderedDict(), "bytes": 0}
+
+
+class DatasetHandle:
+    """Référence d'une session vers un DataFrame du registre partagé."""
+
+    def __init__(self, key, dataset_id, shape):
+        self.key = key
+        self.dataset_id = dataset_id
+        self.shape = shape
+        self._finalizer = weakref.finalize(self, _release_dataset, _dataset_registry(), key)
+
+    @property
+    def columns(self):
+        return self.frame().columns
+
+    def frame(self) -> pd.DataFrame:
+        """Vue du DataFrame partagé ; sous Copy-on-Write, toute écriture reste locale à l'appelant."""
+        return _registry_frame(self.key, self.dataset_id).copy(deep=False)
+
+    def release(self):
+        self._finalizer()
+
+
+def _enforce_memory_budget(registry):
+    """Évince en LRU les DataFrames non référencés, puis ceux que le stockage Parquet permet de relire."""
+    for reloadable in (False, True):
+        for key in list(registry["entries"]):
+            if registry["bytes"] <= DATASET_MEMORY_BUDGET:
+                return
+            entry = registry["entries"][key]
+            if entry["frame"] is None:
+                continue
+            if entry["refs"] <= 0:
+                registry["bytes"] -= entry["bytes"]
+                del registry["entries"][key]
+            elif reloadable and entry["dataset_id"] is not None:
+                registry["bytes"] -= entry["bytes"]
+                entry["frame"], entry["bytes"] = None, 0
+
+
+def _store_frame(registry, key, frame):
+    entry = registry["entries"][key]
+    entry["frame"] = frame
+    entry["bytes"] = int(frame.memory_usage(index=True, deep=True).sum())
+    registry["bytes"] += entry["bytes"]
+    registry["entries"].move_to_end(key)
+    _enforce_memory_budget(registry)
+
+
+def _registry_frame(key, dataset_id):
+    registry = _dataset_registry()
+    with registry["lock"]:
+        entry = registry["entries"].get(key)
+        if entry is not None and entry["frame"] is not None:
+            registry["entries"].move_to_end(key)
+            return entry["frame"]
+    if dataset_id is None:
+        raise KeyError(f"Dataset {key} absent du registre")
+    frame = compact_frame(read_parquet_frame(_dataset_path(dataset_id)))[0]
+    with registry["lock"]:
+        entry = registry["entries"].setdefault(key, {"frame": None, "bytes": 0, "refs": 0, "dataset_id": dataset_id})
+        if entry["frame"] is not None:
+            return entry["frame"]
+        _store_frame(registry, key, frame)
+    return frame
+
+
+def _release_dataset(registry, key):
+    with registry["lock"]:
+        entry = registry["entries"].get(key)
+        if entry is not None:
+            entry["refs"] -= 1
+            if entry["refs"] <= 0 and entry["frame"] is None:
+                del registry["entries"][key]
+            _enforce_memory_budget(registry)
+
+
+def acquire_dataset(frame: pd.DataFrame = None, dataset_id=None) -> DatasetHandle:
+    """Inscrit `frame` dans le registre (ou réutilise l'exemplaire partagé) et retourne un handle."""
+    key = f"dataset-{dataset_id}" if dataset_id is not None else f"session-{dataset_content_hash(frame)}"
+    registry = _dataset_registry()
+    with registry["lock"]:
+        entry = registry["entries"].setdefault(key, {"frame": None, "bytes": 0, "refs": 0, "dataset_id": dataset_id})
+        entry["refs"] += 1
+        if entry["frame"] is None and frame is not None:
+            _store_frame(registry, key, frame)
+        else:
+            registry["entries"].move_to_end(key)
+        current = entry["frame"] if entry["frame"] is not None else frame
+        shape = current.shape if current is not None else None
+    if shape is None:
+        metadata = pq.read_metadata(str(_dataset_path(dataset_id)))
+        shape = (metadata.num_rows, metadata.num_columns)
+    return DatasetHandle(key, dataset_id, shape)
+
+
+# ------------------ Explorateur paginé des données ------------------------
+@st.cache_resource
+def _explorer_cache():
+    return _LRUCache(EXPLORER_CACHE_SIZE)
+
+
+class DatasetExplorer:
+    """Lecture paginée, triée et filtrée côté serveur d'un dataset."""
+
+    def __init__(self, dataset_id=None, frame=None, dataset_key=None):
+        self.dataset_id = dataset_id
+        self.frame = frame
+        if dataset_id is not None:
+            self.path = _dataset_path(dataset_id)
+            self.columns = dataset_columns(dataset_id)
+            self.n_rows = pq.read_metadata(str(self.path)).num_rows
+            self.source_key = ("dataset", dataset_id, self.path.stat().st_mtime)
+        else:
+            self.columns = [str(c) for c in frame.columns]
+            self.n_rows = len(frame)
+            self.source_key = ("session", dataset_key if dataset_key is not None else dataset_content_hash(frame))
+
+    def _column(self, col):
+        if self.dataset_id is not None:
+            return pq.read_table(str(self.path), columns=[col], memory_map=True).column(0).to_pandas()
+        return self.frame[col]
+
+    def _sort_permutation(self, col):
+        """Permutation (croissante, valeurs manquantes en fin) triant le dataset selon `col`."""
+        if self.dataset_id is not None:
+            digest = hashlib.blake2b(col.encode(), digest_size=6).hexdigest()
+            path = self.path.with_name(f"{self.path.stem}.ordre.{digest}.npy")
+            if path.exists() and path.stat().st_mtime >= self.path.stat().st_mtime:
+                return np.load(path, mmap_mode="r")
+        # Rangs triés plutôt que valeurs brutes : un texte avec des NaN ne se compare pas,
+        # et une catégorie est rangée selon l'ordre de ses catégories.
+        codes, uniques = pd.factorize(self._column(col), sort=True)
+        codes[codes < 0] = len(uniques)
+        dtype = np.int32 if self.n_rows < 2**31 else np.int64
+        permutation = np.argsort(codes, kind="stable").astype(dtype)
+        if self.dataset_id is not None:
+            np.save(path, permutation)
+            return np.load(path, mmap_mode="r")
+        return permutation
+
+    def _filter_mask(self, col, value):
+        values = self._column(col)
+        if pd.api.types.is_numeric_dtype(values) and not pd.api.types.is_bool_dtype(values):
+            target = pd.to_numeric(pd.Series([value]), errors="coerce").iloc[0]
+            return (values == target).to_numpy()
+        return values.astype(str).str.contains(value, case=False, regex=False, na=False).to_numpy()
+
+    def order(self, sort_col=None, ascending=True, filter_col=None, filter_value=""):
+        """Positions des lignes dans l'ordre d'affichage ; None pour l'ordre du fichier sans filtre."""
+        filter_value = (filter_value or "").strip()
+        if not sort_col and not (filter_col and filter_value):
+            return None
+        key = (self.source_key, sort_col, ascending, filter_col, filter_value)
+        cache = _explorer_cache()
+        positions = cache.get(key)
+        if positions is None:
+            mask = self._filter_mask(filter_col, filter_value) if filter_col and filter_value else None
+            if sort_col:
+                positions = self._sort_permutation(sort_col)
+                if mask is not None:
+                    positions = positions[mask[positions]]
+                if not ascending:
+                    # Seules les valeurs renseignées sont inversées : les manquantes restent en fin.
+                    n_valid = len(positions) - int(self._column(sort_col).isna().to_numpy()[positions].sum())
+                    positions = np.concatenate([positions[:n_valid][::-1], positions[n_valid:]])
+            else:
+                positions = np.flatnonzero(mask)
+            cache.put(key, positions)
+        return positions
+
+    def page(self, columns, page, page_size, positions=None) -> pd.DataFrame:
+        """Lignes de la page `page` (à partir de 0), pour les seules colonnes demandées."""
+        total = self.n_rows if positions is None else len(positions)
+        start = min(page * page_size, total)
+        stop = min(start + page_size, total)
+        rows = np.arange(start, stop) if positions is None else np.asarray(positions[start:stop])
+        if self.dataset_id is not None:
+            dataset = pads.dataset(str(self.path), format="parquet")
+            view = dataset.take(pa.array(rows, type=pa.int64()), columns=list(columns)).to_pandas()
+        else:
+            view = self.frame.iloc[rows][list(columns)]
+        view.index = pd.RangeIndex(start + 1, stop + 1, name="ligne") if positions is None else pd.Index(rows + 1, name="ligne")
+        return view
+
+
+def _run_query(query, params=()):
+    """Exécute une requête paramétrée et retourne le résultat en DataFrame."""
+    connection = cursor = None
+    try:
+        connection = _get_connection()
+        cursor = connection.cursor()
+        cursor.execute(query, tuple(params))
+        rows = cursor.fetchall()
+        return pd.DataFrame.from_records(rows, columns=cursor.column_names)
+    finally:
+        _release_connection(connection, cursor)
+
+
+def _ventes_filters(dataset_id, start=None, end=None, categorie=None, produits=None):
+    """Clause WHERE paramétrée sur `ventes` (dataset, période, catégorie, produits)."""
+    clauses = ["dataset_id = %s"]
+    params = [dataset_id]
+    if start is not None:
+        clauses.append("date_vente >= %s")
+        params.append(start)
+    if end is not None:
+        clauses.append("date_vente <= %s")
+        params.append(end)
+    if categorie:
+        clauses.append("categorie = %s")
+        params.append(categorie)
+    if produits:
+        clauses.append(f"produit IN ({', '.join(['%s'] * len(produits))})")
+        params.extend(produits)
+    return " AND ".join(clauses), params
+
+
+def _numeric_columns(frame: pd.DataFrame, exclude=()):
+    for col in frame.columns:
+        if col not in exclude:
+            frame[col] = pd.to_numeric(frame[col], errors="coerce")
+    return frame
+
+
+@st.cache_data(ttl=300)
+def query_sales_options(dataset_id):
+    """Bornes de dates, catégories et produits du dataset chargé en base."""
+    bounds = _run_query(
+        "SELECT MIN(date_vente) AS min_date, MAX(date_vente) AS max_date, COUNT(*) AS n FROM ventes WHERE dataset_id = %s",
+        (dataset_id,),
+    )
+    if bounds.empty or not bounds.loc[0, "n"]:
+        return None
+    categories = _run_query(
+        "SELECT DISTINCT categorie FROM ventes WHERE dataset_id = %s AND categorie IS NOT NULL ORDER BY categorie",
+        (dataset_id,),
+    )
+    produits = _run_query(
+        "SELECT DISTINCT produit FROM ventes WHERE dataset_id = %s ORDER BY produit",
+        (dataset_id,),
+    )
+    return {
+        "min_date": pd.Timestamp(bounds.loc[0, "min_date"]),
+        "max_date": pd.Timestamp(bounds.loc[0, "max_date"]),
+        "categories": categories["categorie"].tolist(),
+        "produits": produits["produit"].tolist(),
+    }
+
+
+@st.cache_data(ttl=300)
+def query_dashboard_rollup(dataset_id, start=None, end=None):
+    """Agrégats jour × zone calculés par MySQL (grain de `v_ventes_quotidiennes`), au format de `sales_rollup`."""
+    where, params = _ventes_filters(dataset_id, start, end)
+    # Requête directe sur `ventes` : la vue, agrégée, serait matérialisée pour tous les datasets avant le filtre.
+    cube = _run_query(
+        "SELECT date_vente AS jour, zone, COUNT(*) AS nb_lignes, "
+        "SUM(quantite * prix_unitaire) AS chiffre_affaires, SUM(quantite) AS quantite "
+        f"FROM ventes WHERE {where} GROUP BY date_vente, zone",
+        params,
+    )
+    cube = _numeric_columns(cube, exclude=("jour", "zone"))
+    cube["jour"] = pd.to_datetime(cube["jour"])
+    return {
+        "cube": cube,
+        "sketches": {},
+        "n_rows": int(cube["nb_lignes"].sum()),
+        "n_cols": len(cube.columns),
+    }
+
+
+@st.cache_data(ttl=300)
+def query_top_products(dataset_id, limit, start=None, end=None):
+    """Les `limit` produits au plus fort chiffre d'affaires, classés et limités par MySQL."""
+    where, params = _ventes_filters(dataset_id, start, end)
+    top = _run_query(
+        "SELECT produit, SUM(quantite * prix_unitaire) AS chiffre_affaires "
+        f"FROM ventes WHERE {where} GROUP BY produit ORDER BY chiffre_affaires DESC LIMIT %s",
+        params + [int(limit)],
+    )
+    top = _numeric_columns(top, exclude=("produit",))
+    return top.set_index("produit")["chiffre_affaires"]
+
+
+@st.cache_data(ttl=300)
+def query_analytics_plan(dataset_id, start=None, end=None, categorie=None, produits=()):
+    """Plan d'agrégation de la page Analytics calculé par MySQL (même format que `build_analytics_plan`)."""
+    where, params = _ventes_filters(dataset_id, start, end, categorie, list(produits))
+    by_product = _run_query(
+        "SELECT produit, SUM(quantite) AS quantite, AVG(prix_unitaire) AS prix_unitaire, SUM(stock) AS stock, "
+        "SUM(quantite * prix_unitaire) AS ca, SUM(quantite * (prix_unitaire - cout_unitaire)) AS marge "
+        f"FROM ventes WHERE {where} GROUP BY produit",
+        params,
+    )
+    by_product = _numeric_columns(by_product, exclude=("produit",)).set_index("produit")
+    monthly = _run_query(
+        "SELECT DATE_FORMAT(date_vente, '%Y-%m-01') AS date, SUM(quantite) AS quantite, AVG(prix_unitaire) AS prix_unitaire "
+        f"FROM ventes WHERE {where} GROUP BY DATE_FORMAT(date_vente, '%Y-%m-01') ORDER BY date",
+        params,
+    )
+    monthly = _numeric_columns(monthly, exclude=("date",))
+    monthly["date"] = pd.to_datetime(monthly["date"])
+    low_stock = _run_query(f"SELECT COUNT(*) AS n FROM ventes WHERE {where} AND stock < %s", params + [SEUIL_STOCK_BAS])
+
+    by_product = by_product.dropna(axis=1, how="all")
+    if "marge" in by_product.columns:
+        # SUM ignore les ventes sans coût ; un produit qui n'en a aucun compte 0, comme le groupby pandas.
+        by_product["marge"] = by_product["marge"].fillna(0)
+    totals = by_product.sum()
+    metrics = {
+        "ventes": totals.get("quantite", 0),
+        "ca": totals.get("ca", 0),
+        "stock_total": totals.get("stock", 0),
+        "produits_stock_bas": int(low_stock.loc[0, "n"]),
+    }
+    if "marge" in totals:
+        # Comme en mode session : pas de marge sans coût unitaire renseigné.
+        metrics["marge"] = totals["marge"]
+        metrics["taux_marge"] = (metrics["marge"] / metrics["ca"]) * 100 if metrics["ca"] else 0
+    return {
+        "by_product": by_product,
+        "monthly": monthly,
+        "metrics": metrics,
+        "n_products": len(by_product),
+    }
+
+
+@st.cache_data(ttl=300)
+def query_product_report(dataset_id, report_type, start=None, end=None, categorie=None, produits=()):
+    """Rapport produits agrégé par MySQL, mêmes colonnes que `build_product_report`."""
+    where, params = _ventes_filters(dataset_id, start, end, categorie, list(produits))
+    report = _run_query(
+        "SELECT produit AS Produit, SUM(COALESCE(quantite, 0)) AS Ventes_Totales, "
+        "SUM(COALESCE(quantite, 0) * COALESCE(prix_unitaire, 0)) AS CA_Total, "
+        "CASE WHEN COUNT(cout_unitaire) = 0 THEN NULL "
+        "ELSE SUM((COALESCE(prix_unitaire, 0) - COALESCE(cout_unitaire, 0)) * COALESCE(quantite, 0)) END AS Marge_Totale, "
+        "SUM(COALESCE(stock, 0)) AS Stock_Actuel "
+        f"FROM ventes WHERE {where} GROUP BY produit ORDER BY produit",
+        params,
+    )
+    report = _numeric_columns(report, exclude=("Produit",))
+    report["Date_Export"] = datetime.now().strftime("%Y-%m-%d %H:%M")
+    return report[REPORT_COLUMNS[report_type]]
+
+
+# ------------------ Chargement en masse dans `ventes` ---------------------
+def _prepare_ventes_rows(chunk: pd.DataFrame):
+    """Aligne un bloc brut sur les colonnes de `ventes` et retourne les tuples à insérer."""
+    df = normalize_product_columns(chunk)
+    missing = [c for c in ("date", "produit", "quantite") if c not in df.columns]
+    if missing:
+        raise ValueError(f"Colonnes obligatoires introuvables : {', '.join(missing)}")
+    frame = pd.DataFrame(
+        {
+            "date_vente": pd.to_datetime(df["date"], errors="coerce").dt.date,
+            "produit": df["produit"].astype("string").str.slice(0, 100),
+            "categorie": df["categorie"].astype("string").str.slice(0, 50) if "categorie" in df.columns else None,
+            "zone": df["zone"].astype("string").str.slice(0, 50) if "zone" in df.columns else None,
+            **{
+                col: pd.to_numeric(df[col], errors="coerce") if col in df.columns else None
+                for col in ("quantite", "prix_unitaire", "cout_unitaire", "stock")
+            },
+        },
+        index=df.index,
+    )[VENTES_COLUMNS]
+    frame = frame.dropna(subset=["date_vente", "produit", "quantite"])
+    frame = frame.astype(object).where(frame.notna(), None)
+    return list(frame.itertuples(index=False, name=None))
+
+
+def bulk_load_ventes(dataset_id, chunks, expected_rows=None, on_progress=None, batch_rows=BULK_BATCH_ROWS):
+    """Charge les blocs `chunks` dans `ventes` par INSERT multi-lignes et retourne le débit."""
+    placeholders = ", ".join(["%s"] * (len(VENTES_COLUMNS) + 1))
+    insert = f"INSERT INTO ventes (dataset_id, {', '.join(VENTES_COLUMNS)}) VALUES ({placeholders})"
+    started = time.monotonic()
+    loaded = 0
+    connection = cursor = None
+    try:
+        connection = _get_connection()
+        connection.autocommit = False
+        cursor = connection.cursor()
+        cursor.execute("SET SESSION unique_checks = 0, SESSION foreign_key_checks = 0")
+        try:
+            cursor.execute("DELETE FROM ventes WHERE dataset_id = %s", (dataset_id,))
+            for chunk in chunks:
+                rows = _prepare_ventes_rows(chunk)
+                for start in range(0, len(rows), batch_rows):
+                    batch = [(dataset_id,) + row for row in rows[start:start + batch_rows]]
+                    cursor.executemany(insert, batch)
+                    loaded += len(batch)
+                if on_progress and expected_rows:
+                    on_progress(min(1.0, loaded / expected_rows), loaded)
+            connection.commit()
+        except BaseException:
+            connection.rollback()
+            raise
+        finally:
+            cursor.execute("SET SESSION unique_checks = 1, SESSION foreign_key_checks = 1")
+    finally:
+        _release_connection(connection, cursor)
+
+    elapsed = max(time.monotonic() - started, 1e-6)
+    return {"rows": loaded, "seconds": elapsed, "rows_per_second": loaded / elapsed}
+
+
+# ------------------ Tendances Google (table tendances) --------------------
+@st.cache_resource
+def _trends_rate_limiter():
+    return {"lock": threading.Lock(), "last": 0.0}
+
+
+def _wait_trends_slot():
+    """Espace les appels à Google Trends d'au moins TRENDS_MIN_INTERVAL secondes (tous utilisateurs)."""
+    limiter = _trends_rate_limiter()
+    with limiter["lock"]:
+        delay = limiter["last"] + TRENDS_MIN_INTERVAL - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        limiter["last"] = time.monotonic()
+
+
+def _trends_fixture_path(fixture_dir: Path, keyword) -> Path:
+    return fixture_dir / f"{keyword.strip().lower().replace('/', '_')}.csv"
+
+
+def _fetch_trends_batch(keywords, start, end, geo, fixture_dir=None) -> pd.DataFrame:
+    """Scores d'un lot de mots-clés (au plus TRENDS_BATCH_KEYWORDS) au format long."""
+    if fixture_dir is not None:
+        frames = []
+        for keyword in keywords:
+            path = _trends_fixture_path(fixture_dir, keyword)
+            if not path.exists():
+                continue
+            fixture = pd.read_csv(path, parse_dates=["date"])
+            fixture = fixture[(fixture["date"] >= start) & (fixture["date"] <= end)]
+            frames.append(fixture.assign(mot_cle=keyword)[["date", "mot_cle", "score_tendance"]])
+        return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=["date", "mot_cle", "score_tendance"])
+
+    from pytrends.request import TrendReq
+
+    _wait_trends_slot()
+    client = TrendReq(hl="fr-FR", timeout=(5, 20))
+    try:
+        client.build_payload(list(keywords), timeframe=f"{start:%Y-%m-%d} {end:%Y-%m-%d}", geo=geo)
+        wide = client.interest_over_time()
+    except Exception as e:
+        raise ValueError(f"Google Trends indisponible : {e}") from e
+    if wide.empty:
+        return pd.DataFrame(columns=["date", "mot_cle", "score_tendance"])
+    wide = wide.drop(columns="isPartial", errors="ignore")
+    return wide.reset_index().melt(id_vars="date", var_name="mot_cle", value_name="score_tendance")
+
+
+def _last_trend_scores(keywords, zone):
+    """Dernière date et scores de la fenêtre de recouvrement déjà stockés, par mot-clé."""
+    placeholders = ", ".join(["%s"] * len(keywords))
+    return _run_query(
+        f"SELECT t.mot_cle, t.date, t.score_tendance FROM tendances t "
+        f"JOIN (SELECT mot_cle, MAX(date) AS last_date FROM tendances "
+        f"WHERE zone = %s AND mot_cle IN ({placeholders}) GROUP BY mot_cle) m "
+        f"ON t.mot_cle = m.mot_cle AND t.date > m.last_date - INTERVAL {TRENDS_OVERLAP_DAYS} DAY "
+        f"WHERE t.zone = %s",
+        (zone, *keywords, zone),
+    )
+
+
+def refresh_trends(keywords, zone=TRENDS_GEO, categorie=None, fixture_dir=None, on_progress=None):
+    """Met à jour la table `tendances` pour `keywords` et retourne le nombre de lignes écrites."""
+    keywords = list(dict.fromkeys(k.strip() for k in keywords if k and k.strip()))
+    if not keywords:
+        return 0
+    today = pd.Timestamp.today().normalize()
+    stored = _last_trend_scores(keywords, zone)
+    last_dates = stored.groupby("mot_cle")["date"].max() if not stored.empty else pd.Series(dtype=object)
+    starts = {}
+    for keyword in keywords:
+        last = last_dates.get(keyword)
+        if last is None:
+            starts[keyword] = today - pd.Timedelta(days=TRENDS_HISTORY_DAYS)
+        elif pd.Timestamp(last) < today:
+            starts[keyword] = pd.Timestamp(last) - pd.Timedelta(days=TRENDS_OVERLAP_DAYS)
+    by_start = {}
+    for keyword, start in starts.items():
+        by_start.setdefault(start, []).append(keyword)
+    batches = [
+        (start, names[i:i + TRENDS_BATCH_KEYWORDS])
+        for start, names in by_start.items()
+        for i in range(0, len(names), TRENDS_BATCH_KEYWORDS)
+    ]
+
+    written = 0
+    for done, (start, batch) in enumerate(batches, start=1):
+        fetched = _fetch_trends_batch(batch, start, today, zone, fixture_dir)
+        if fetched.empty:
+            continue
+        fetched["date"] = pd.to_datetime(fetched["date"]).dt.normalize()
+        fetched["score_tendance"] = pd.to_numeric(fetched["score_tendance"], errors="coerce").astype(np.float64)
+        if not stored.empty:
+            previous = stored.assign(date=pd.to_datetime(stored["date"]))
+            overlap = fetched.merge(previous, on=["mot_cle", "date"], suffixes=("", "_stocke"))
+            if not overlap.empty:
+                sums = overlap.groupby("mot_cle")[["score_tendance", "score_tendance_stocke"]].sum()
+                ratio = (sums["score_tendance_stocke"] / sums["score_tendance"]).replace([np.inf, -np.inf], np.nan)
+                fetched["score_tendance"] *= fetched["mot_cle"].map(ratio).fillna(1.0).to_numpy()
+        rows = [
+            (day.date(), keyword[:100], int(round(score)), zone, categorie)
+            for day, keyword, score in fetched[["date", "mot_cle", "score_tendance"]].dropna().itertuples(index=False, name=None)
+        ]
+        connection = cursor = None
+        try:
+            connection = _get_connection()
+            cursor = connection.cursor()
+            cursor.executemany(
+                "INSERT INTO tendances (date, mot_cle, score_tendance, zone, categorie) VALUES (%s, %s, %s, %s, %s) "
+                "ON DUPLICATE KEY UPDATE score_tendance = VALUES(score_tendance), "
+                "categorie = COALESCE(VALUES(categorie), categorie)",
+                rows,
+            )
+            connection.commit()
+        finally:
+            _release_connection(connection, cursor)
+        written += len(rows)
+        if on_progress:
+            on_progress(done / len(batches))
+    load_trends.clear()
+    return written
+
+
+@st.cache_data(ttl=300)
+def load_trends(keywords, zone=TRENDS_GEO, start=None, end=None) -> pd.DataFrame:
+    """Scores stockés dans `tendances` (date, mot_cle, score_tendance) : aucune requête réseau."""
+    keywords = tuple(keywords)
+    if not keywords:
+        return pd.DataFrame(columns=["date", "mot_cle", "score_tendance"])
+    clauses = ["zone = %s", f"mot_cle IN ({', '.join(['%s'] * len(keywords))})"]
+    params = [zone, *keywords]
+    if start is not None and end is not None:
+        clauses.append("date BETWEEN %s AND %s")
+        params += [start, end]
+    trends = _run_query(
+        f"SELECT date, mot_cle, score_tendance FROM tendances WHERE {' AND '.join(clauses)} ORDER BY date",
+        params,
+    )
+    if not trends.empty:
+        trends["date"] = pd.to_datetime(trends["date"])
+    return trends
+
+
+# ------------------ Calendrier des jours fériés ----------------------------
+class CalendarIndex:
+    """Caractéristiques calendaires pré-calculées, jour par jour et par zone."""
+
+    def __init__(self, start, zones, kind, days_to, days_since, names):
+        self.start = start
+        self.zones = zones
+        self.kind = kind
+        self.days_to = days_to
+        self.days_since = days_since
+        self.names = names
+
+    @property
+    def n_days(self):
+        return self.kind.shape[1]
+
+    def zone_codes(self, zones):
+        """Ligne du calendrier de chaque zone (0 pour les zones sans fériés locaux)."""
+        lookup = {zone: i for i, zone in enumerate(self.zones) if i}
+        codes, uniques = pd.factorize(pd.Series(zones, dtype="object").str.strip().str.lower())
+        mapped = np.array([lookup.get(u, 0) for u in uniques] + [0], dtype=np.intp)
+        return mapped[codes]
+
+    def positions(self, dates):
+        days = pd.DatetimeIndex(pd.to_datetime(dates, errors="coerce")).floor("D")
+        offsets = np.asarray((days - self.start).days, dtype=np.float64)
+        valid = ~np.isnan(offsets) & (offsets >= 0) & (offsets < self.n_days)
+        return np.where(valid, offsets, 0).astype(np.intp), valid
+
+    def holiday_frame(self, zone):
+        """Fériés de `zone` au format attendu par Prophet (colonnes holiday, ds), ou None."""
+        row = self.zone_codes([zone])[0]
+        offsets = np.flatnonzero(self.kind[row])
+        if offsets.size == 0:
+            return None
+        return pd.DataFrame(
+            {
+                "holiday": [f"ferie_{HOLIDAY_TYPES[k - 1]}" for k in self.kind[row, offsets]],
+                "ds": self.start + pd.to_timedelta(offsets, unit="D"),
+            }
+        )
+
+    def features(self, dates, zones=None) -> pd.DataFrame:
+        """Jointure vectorisée des caractéristiques calendaires sur des dates (et zones)."""
+        positions, valid = self.positions(dates)
+        rows = self.zone_codes(zones) if zones is not None else np.zeros(len(positions), dtype=np.intp)
+        kind = np.where(valid, self.kind[rows, positions], 0)
+        return pd.DataFrame(
+            {
+                "est_ferie": (kind > 0).astype(np.int8),
+                "type_ferie": kind.astype(np.int8),
+                "jours_avant_ferie": np.where(valid, self.days_to[rows, positions], HOLIDAY_DISTANCE_CAP).astype(np.uint8),
+                "jours_depuis_ferie": np.where(valid, self.days_since[rows, positions], HOLIDAY_DISTANCE_CAP).astype(np.uint8),
+            }
+        )
+
+
+def _holiday_rows(first_year, last_year) -> pd.DataFrame:
+    """Fériés du package `holidays` et de la table jours_feries (date, nom, type, zone)."""
+    import holidays
+
+    official = holidays.country_holidays(HOLIDAY_COUNTRY, years=range(first_year, last_year + 1))
+    rows = pd.DataFrame(
+        [
+            (
+                pd.Timestamp(day),
+                name,
+                "religieux" if any(k in name for k in HOLIDAY_RELIGIOUS_KEYWORDS) else "national",
+                None,
+            )
+            for day, name in official.items()
+        ],
+        columns=["date", "nom_ferie", "type_ferie", "zone"],
+    )
+    try:
+        stored = _run_query(
+            "SELECT date, nom_ferie, type_ferie, zone FROM jours_feries WHERE date BETWEEN %s AND %s",
+            (datetime(first_year, 1, 1).date(), datetime(last_year, 12, 31).date()),
+        )
+    except Error:
+        stored = pd.DataFrame()
+    if not stored.empty:
+        stored["date"] = pd.to_datetime(stored["date"])
+        rows = pd.concat([rows, stored], ignore_index=True)
+    rows["zone"] = rows["zone"].str.strip().str.lower()
+    return rows
+
+
+def _holiday_distances(flags):
+    """Jours jusqu'au prochain férié et depuis le précédent, plafonnés (searchsorted)."""
+    days = np.arange(flags.shape[0])
+    holidays_at = np.flatnonzero(flags)
+    if holidays_at.size == 0:
+        full = np.full(flags.shape[0], HOLIDAY_DISTANCE_CAP, dtype=np.uint8)
+        return full, full.copy()
+    padded = np.concatenate([[-10 * HOLIDAY_DISTANCE_CAP], holidays_at, [flags.shape[0] + 10 * HOLIDAY_DISTANCE_CAP]])
+    following = padded[np.searchsorted(padded, days, side="left")]
+    preceding = padded[np.searchsorted(padded, days, side="right") - 1]
+    return (
+        np.minimum(following - days, HOLIDAY_DISTANCE_CAP).astype(np.uint8),
+        np.minimum(days - preceding, HOLIDAY_DISTANCE_CAP).astype(np.uint8),
+    )
+
+
+@st.cache_resource
+def calendar_index(first_year, last_year) -> CalendarIndex:
+    """Index calendaire construit une seule fois par plage d'années."""
+    start = pd.Timestamp(first_year, 1, 1)
+    n_days = (pd.Timestamp(last_year, 12, 31) - start).days + 1
+    rows = _holiday_rows(first_year, last_year)
+    zones = [None] + sorted(z for z in rows["zone"].dropna().unique())
+    kind = np.zeros((len(zones), n_days), dtype=np.int8)
+    names = {}
+    national = rows[rows["zone"].isna()]
+    for i, zone in enumerate(zones):
+        subset = national if zone is None else pd.concat([national, rows[rows["zone"] == zone]])
+        offsets = (subset["date"] - start).dt.days.to_numpy()
+        codes = subset["type_ferie"].map({t: c for c, t in enumerate(HOLIDAY_TYPES, start=1)}).to_numpy()
+        kind[i, offsets] = codes
+    for day, name in zip(national["date"], national["nom_ferie"]):
+        names[day] = name
+    distances = [_holiday_distances(kind[i] > 0) for i in range(len(zones))]
+    days_to = np.vstack([d[0] for d in distances])
+    days_since = np.vstack([d[1] for d in distances])
+    return CalendarIndex(start, zones, kind, days_to, days_since, names)
+
+
+def calendar_for(first_date, last_date) -> CalendarIndex:
+    """Index calendaire couvrant les années de `first_date` à `last_date`."""
+    return calendar_index(pd.Timestamp(first_date).year, pd.Timestamp(last_date).year)
+
+
+# ------------------ Enrichissement météo (table meteo) --------------------
+@st.cache_resource
+def _weather_cache():
+    return _LRUCache(WEATHER_CACHE_SIZE)
+
+
+@st.cache_data(ttl=300)
+def load_meteo(start, end) -> pd.DataFrame:
+    """Relevés de `meteo` entre deux dates, triés par date, zones normalisées."""
+    meteo = _run_query(
+        "SELECT date, zone, temperature, precipitation, humidite FROM meteo WHERE date BETWEEN %s AND %s ORDER BY date",
+        (start, end),
+    )
+    if meteo.empty:
+        return meteo
+    meteo["date"] = pd.to_datetime(meteo["date"])
+    meteo["zone"] = meteo["zone"].astype(str).str.strip().str.lower()
+    for col in WEATHER_COLUMNS:
+        meteo[col] = pd.to_numeric(meteo[col], errors="coerce").astype(np.float32)
+    return meteo
+
+
+def _build_weather_keys(df: pd.DataFrame, date_col, zone_col):
+    """Clés jour × zone distinctes des ventes, jointes au relevé météo le plus proche."""
+    days = pd.to_datetime(df[date_col], errors="coerce").dt.floor("D")
+    zone_codes, zone_values = pd.factorize(df[zone_col])
+    zone_names = pd.Index(zone_values).astype(str).str.strip().str.lower()
+    day_numbers = days.to_numpy(dtype="datetime64[D]").astype(np.int64)
+    valid = days.notna().to_numpy() & (zone_codes >= 0)
+    combined = np.where(valid, day_numbers * max(1, len(zone_names)) + zone_codes, -1)
+    codes, uniques = pd.factorize(combined)
+    keep = uniques >= 0
+    keys = pd.DataFrame(
+        {
+            "date": (uniques // max(1, len(zone_names))).astype("datetime64[D]").astype("datetime64[ns]"),
+            "zone": np.asarray(zone_names)[uniques % max(1, len(zone_names))],
+        }
+    )
+    # Les clés invalides (date ou zone manquante) restent sans météo.
+    keys.loc[~keep, ["date", "zone"]] = [pd.NaT, None]
+    table = keys.assign(**{col: np.float32(np.nan) for col in WEATHER_COLUMNS}, ecart_meteo_jours=np.nan)
+    if keep.any():
+        first, last = keys.loc[keep, "date"].min(), keys.loc[keep, "date"].max()
+        tolerance = pd.Timedelta(days=WEATHER_TOLERANCE_DAYS)
+        meteo = load_meteo((first - tolerance).date(), (last + tolerance).date())
+        if not meteo.empty:
+            valid_keys = keys[keep].reset_index().sort_values("date")
+            merged = pd.merge_asof(
+                valid_keys,
+                meteo.assign(date_meteo=meteo["date"].astype("datetime64[ns]")).drop(columns="date"),
+                left_on="date",
+                right_on="date_meteo",
+                by="zone",
+                direction="nearest",
+                tolerance=tolerance,
+            ).set_index("index")
+            table.loc[merged.index, WEATHER_COLUMNS] = merged[WEATHER_COLUMNS].to_numpy()
+            table.loc[merged.index, "ecart_meteo_jours"] = (merged["date"] - merged["date_meteo"]).abs().dt.days
+    return codes, table
+
+
+def _weather_keys(df: pd.DataFrame, date_col, zone_col, dataset_key=None):
+    if dataset_key is None:
+        return _build_weather_keys(df, date_col, zone_col)
+    key = (dataset_key, date_col, zone_col)
+    cache = _weather_cache()
+    result = cache.get(key)
+    if result is None:
+        result = _build_weather_keys(df, date_col, zone_col)
+        cache.put(key, result)
+    return result
+
+
+def weather_by_day_zone(df: pd.DataFrame, date_col, zone_col, value_col, dataset_key=None) -> pd.DataFrame:
+    """Somme de `value_col` par jour et zone, accompagnée de la météo correspondante."""
+    codes, table = _weather_keys(df, date_col, zone_col, dataset_key)
+    values = pd.to_numeric(df[value_col], errors="coerce").fillna(0).to_numpy(dtype=np.float64)
+    totals = np.bincount(codes, weights=values, minlength=len(table))
+    return table.assign(**{value_col: totals}).dropna(subset=["date"])
+
+
+# ------------------ Prévisions de la demande ------------------------------
+def forecast_series(df: pd.DataFrame) -> pd.DataFrame:
+    """Quantités journalières par produit (et zone si disponible), au format long."""
+    df = normalize_product_columns(df)
+    missing = [c for c in ("date", "produit", "quantite") if c not in df.columns]
+    if missing:
+        raise ValueError(f"Colonnes nécessaires à la prévision introuvables : {', '.join(missing)}")
+    keys = ["produit", "zone"] if "zone" in df.columns else ["produit"]
+    frame = pd.DataFrame(
+        {
+            **{k: df[k] for k in keys},
+            "ds": pd.to_datetime(df["date"], errors="coerce").dt.floor("D"),
+            "y": pd.to_numeric(df["quantite"], errors="coerce"),
+        }
+    ).dropna(subset=keys + ["ds"])
+    series = frame.groupby(keys + ["ds"], observed=True)["y"].sum().reset_index()
+    if "zone" not in series.columns:
+        series["zone"] = None
+    return series
+
+
+def _dump_model(model, path: Path):
+    """Écrit le modèle via un fichier temporaire renommé : un lecteur ne voit jamais de fichier partiel."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    staging = path.with_name(f"{path.name}.{os.getpid()}-{threading.get_ident()}.tmp")
+    try:
+        joblib.dump(model, staging)
+        os.replace(staging, path)
+    finally:
+        staging.unlink(missing_ok=True)
+
+
+def _series_model_path(model_dir: Path, key) -> Path:
+    return model_dir / f"{hashlib.blake2b(repr(key).encode(), digest_size=10).hexdigest()}.joblib"
+
+
+def _fit_forecast_batch(batch, future_dates, model_dir, reuse_after, calendar):
+    """Entraîne (ou recharge) puis projette un modèle Prophet par série d'un lot."""
+    from prophet import Prophet
+
+    logging.getLogger("cmdstanpy").setLevel(logging.WARNING)
+    results = []
+    for key, history in batch:
+        path = _series_model_path(model_dir, key)
+        if path.exists() and path.stat().st_mtime >= reuse_after:
+            model = joblib.load(path)
+        else:
+            model = Prophet(
+                interval_width=FORECAST_INTERVAL_WIDTH,
+                daily_seasonality=False,
+                weekly_seasonality=True,
+                yearly_seasonality=len(history) >= 365,
+                holidays=calendar.holiday_frame(key[1]),
+            )
+            model.fit(history)
+            _dump_model(model, path)
+        predicted = model.predict(pd.DataFrame({"ds": future_dates}))[["ds", "yhat", "yhat_lower", "yhat_upper"]]
+        predicted["produit"], predicted["zone"] = key
+        results.append(predicted)
+    return results
+
+
+def _forecast_executor():
+    # Des threads plutôt que des processus : le script Streamlit n'est pas importable
+    # par nom (les workers devraient être forkés depuis un serveur multi-thread), et
+    # l'optimisation Prophet tourne de toute façon dans un processus cmdstan séparé.
+    return ThreadPoolExecutor(max_workers=FORECAST_WORKERS, thread_name_prefix="forecast")
+
+
+def _naive_forecast(series: pd.DataFrame, future_dates) -> pd.DataFrame:
+    """Prévision plate (moyenne des 28 derniers jours) pour les séries trop courtes."""
+    if series.empty:
+        return pd.DataFrame(columns=["ds", "yhat", "yhat_lower", "yhat_upper", "produit", "zone"])
+    recent = series[series["ds"] >= future_dates[0] - pd.Timedelta(days=28)]
+    level = recent.groupby(["produit", "zone"], dropna=False, observed=True)["y"].sum() / 28
+    level = level.reindex(series.groupby(["produit", "zone"], dropna=False, observed=True).size().index, fill_value=0)
+    grid = level.reset_index().merge(pd.DataFrame({"ds": future_dates}), how="cross")
+    grid = grid.rename(columns={"y": "yhat"})
+    grid["yhat_lower"] = grid["yhat_upper"] = grid["yhat"]
+    return grid
+
+
+def run_forecast(dataset_key, series: pd.DataFrame, horizon_days, reuse_after=0.0, on_progress=None):
+    """Prévision par série (produit × zone) sur un pool de workers."""
+    model_dir = MODEL_STORE_DIR / str(dataset_key) / MODEL_VERSION / f"h{horizon_days}"
+    model_dir.mkdir(parents=True, exist_ok=True)
+
+    future_dates = pd.date_range(series["ds"].max() + pd.Timedelta(days=1), periods=horizon_days, freq="D")
+    calendar = calendar_for(series["ds"].min(), future_dates[-1])
+    sizes = series.groupby(["produit", "zone"], dropna=False, observed=True)["ds"].transform("size")
+    trainable = series[sizes >= FORECAST_MIN_HISTORY]
+    forecasts = [_naive_forecast(series[sizes < FORECAST_MIN_HISTORY], future_dates)]
+
+    groups = [
+        (key, history[["ds", "y"]].reset_index(drop=True))
+        for key, history in trainable.groupby(["produit", "zone"], dropna=False, observed=True, sort=False)
+    ]
+    batches = [groups[i:i + FORECAST_BATCH_SERIES] for i in range(0, len(groups), FORECAST_BATCH_SERIES)]
+    if batches:
+        with _forecast_executor() as executor:
+            futures = {
+                executor.submit(_fit_forecast_batch, batch, future_dates, model_dir, reuse_after, calendar): batch
+                for batch in batches
+            }
+            for done, future in enumerate(as_completed(futures), start=1):
+                try:
+                    forecasts.extend(future.result())
+                except Exception:
+                    logging.getLogger(__name__).warning("Échec de l'entraînement d'un lot de séries", exc_info=True)
+                    failed = pd.concat([history.assign(produit=key[0], zone=key[1]) for key, history in futures[future]])
+                    forecasts.append(_naive_forecast(failed, future_dates))
+                if on_progress:
+                    on_progress(done / len(futures))
+
+    forecasts = [f for f in forecasts if not f.empty] or forecasts[:1]
+    forecast = pd.concat(forecasts, ignore_index=True)
+    for col in ("yhat", "yhat_lower", "yhat_upper"):
+        forecast[col] = forecast[col].clip(lower=0)
+    return forecast.rename(columns={"ds": "date"})[["produit", "zone", "date", "yhat", "yhat_lower", "yhat_upper"]]
+
+
+def _series_matrix(series: pd.DataFrame):
+    """Matrice dense séries × jours (jours sans vente à 0) et clés des séries."""
+    start = series["ds"].min()
+    n_days = (series["ds"].max() - start).days + 1
+    codes, keys = pd.MultiIndex.from_frame(series[["produit", "zone"]]).factorize()
+    matrix = np.zeros((len(keys), n_days), dtype=np.float32)
+    matrix[codes, (series["ds"] - start).dt.days.to_numpy()] = series["y"].to_numpy(dtype=np.float32)
+    return matrix, keys, start
+
+
+def _global_features(matrix, start, positions, calendar, zone_rows):
+    """Features (retards, moyennes glissantes, calendrier, fériés) pour chaque série et position."""
+    positions = np.asarray(positions)
+    cumsum = np.zeros((matrix.shape[0], matrix.shape[1] + 1), dtype=np.float64)
+    np.cumsum(matrix, axis=1, out=cumsum[:, 1:])
+    columns = [matrix[:, positions - lag] for lag in GLOBAL_LAGS]
+    columns += [(cumsum[:, positions] - cumsum[:, positions - w]) / w for w in GLOBAL_WINDOWS]
+    columns.append(cumsum[:, positions] / positions)
+    dates = start + pd.to_timedelta(positions, unit="D")
+    shape = (matrix.shape[0], len(positions))
+    columns.append(np.broadcast_to(dates.dayofweek.to_numpy(), shape))
+    columns.append(np.broadcast_to(dates.month.to_numpy(), shape))
+    days = positions + (start - calendar.start).days
+    rows = zone_rows[:, None]
+    columns.append(calendar.kind[rows, days])
+    columns.append(calendar.days_to[rows, days])
+    columns.append(calendar.days_since[rows, days])
+    return np.stack(columns, axis=-1).astype(np.float32).reshape(-1, len(columns))
+
+
+def _global_model_path(lineage) -> Path:
+    return MODEL_STORE_DIR / str(lineage) / "global_xgb.joblib"
+
+
+def _history_digest(matrix, n_days) -> str:
+    """Empreinte des `n_days` premiers jours de la matrice séries × jours."""
+    return hashlib.blake2b(np.ascontiguousarray(matrix[:, :n_days]).tobytes(), digest_size=16).hexdigest()
+
+
+def run_global_forecast(lineage, series: pd.DataFrame, horizon_days):
+    """Prévision de toutes les séries par un unique modèle XGBoost, persisté par lignée de datasets."""
+    matrix, keys, start = _series_matrix(series)
+    n_days = matrix.shape[1]
+    first_position = max(max(GLOBAL_LAGS), max(GLOBAL_WINDOWS))
+    if n_days <= first_position:
+        raise ValueError(f"Au moins {first_position + 1} jours d'historique sont nécessaires pour le modèle global.")
+
+    calendar = calendar_for(start, start + pd.Timedelta(days=n_days + horizon_days))
+    zone_rows = calendar.zone_codes(keys.get_level_values(1))
+
+    path = _global_model_path(lineage)
+    with forecast_lock(path):  # un seul entraînement à la fois par modèle, quel que soit l'horizon
+        state = joblib.load(path) if path.exists() else None
+        # Réentraînement incrémental seulement si l'historique déjà appris est un préfixe inchangé des données.
+        if (
+            state is not None
+            and state["version"] == GLOBAL_MODEL_VERSION
+            and state["start"] == start
+            and state["keys"] == keys.tolist()
+            and state["n_days"] <= n_days
+            and state["history"] == _history_digest(matrix, state["n_days"])
+        ):
+            trained_until = state["n_days"]
+        else:
+            state, trained_until = None, None
+
+        stats = {"mode": "réutilisé", "train_rows": 0, "feature_bytes": 0}
+        if state is None or n_days > trained_until:
+            if state is None:
+                positions = np.arange(max(first_position, n_days - GLOBAL_TRAIN_DAYS), n_days)
+                model = XGBRegressor(
+                    n_estimators=GLOBAL_TREES,
+                    max_depth=6,
+                    learning_rate=0.05,
+                    subsample=0.8,
+                    tree_method="hist",
+                    n_jobs=FORECAST_WORKERS,
+                )
+                previous, stats["mode"] = None, "complet"
+            else:
+                positions = np.arange(trained_until, n_days)
+                model = state["model"]
+                model.set_params(n_estimators=GLOBAL_INCREMENTAL_TREES)
+                previous, stats["mode"] = model.get_booster(), "incrémental"
+            features = _global_features(matrix, start, positions, calendar, zone_rows)
+            target = matrix[:, positions].reshape(-1)
+            model.fit(features, target, xgb_model=previous)
+            residuals = target - model.predict(features)
+            rmse = float(np.sqrt(np.mean(residuals ** 2)))
+            stats.update(train_rows=len(target), feature_bytes=features.nbytes + target.nbytes + matrix.nbytes)
+            del features, target, residuals
+            state = {
+                "version": GLOBAL_MODEL_VERSION,
+                "model": model,
+                "start": start,
+                "keys": keys.tolist(),
+                "n_days": n_days,
+                "history": _history_digest(matrix, n_days),
+                "rmse": rmse,
+            }
+            _dump_model(state, path)
+
+    # Prévision récursive : chaque pas est prédit pour toutes les séries à la fois.
+    extended = np.concatenate([matrix, np.zeros((matrix.shape[0], horizon_days), dtype=np.float32)], axis=1)
+    for step in range(horizon_days):
+        position = n_days + step
+        prediction = state["model"].predict(_global_features(extended, start, [position], calendar, zone_rows))
+        extended[:, position] = np.maximum(prediction, 0)
+
+    future = extended[:, n_days:]
+    margin = 1.2816 * state["rmse"]  # quantile normal à 80 %
+    dates = pd.date_range(start + pd.Timedelta(days=n_days), periods=horizon_days, freq="D")
+    forecast = pd.DataFrame(
+        {
+            "produit": np.repeat(keys.get_level_values(0), horizon_days),
+            "zone": np.repeat(keys.get_level_values(1), horizon_days),
+            "date": np.tile(dates, len(keys)),
+            "yhat": future.reshape(-1).astype(np.float64),
+        }
+    )
+    forecast["yhat_lower"] = (forecast["yhat"] - margin).clip(lower=0)
+    forecast["yhat_upper"] = forecast["yhat"] + margin
+    return forecast, stats
+
+
+def scenario_profile(scenario, horizon_days):
+    """Répartition (0 à 1) de l'effet du scénario sur chaque jour de l'horizon."""
+    t = np.arange(horizon_days, dtype=np.float64)
+    profile = SCENARIOS[scenario]["profil"]
+    if profile == "campagne":
+        return np.exp(-t / max(1.0, horizon_days / 2))
+    if profile == "lancement":
+        return 1 - np.exp(-(t + 1) / max(1.0, horizon_days / 4))
+    return np.ones(horizon_days)
+
+
+def budget_lift(scenario, budget):
+    """Hausse maximale de la demande apportée par `budget`, avec rendements décroissants."""
+    params = SCENARIOS[scenario]
+    return params["lift_max"] * budget / (budget + params["demi_saturation"])
+
+
+def simulate_budget_grid(baseline, horizon_days, budgets=BUDGET_GRID):
+    """Unités totales projetées pour chaque scénario et chaque budget de la grille."""
+    baseline = np.asarray(baseline, dtype=np.float64)
+    budgets = np.asarray(budgets, dtype=np.float64)
+    names = list(SCENARIOS)
+    profiles = np.vstack([scenario_profile(name, horizon_days) for name in names])
+    lift_max = np.array([SCENARIOS[name]["lift_max"] for name in names])[:, None]
+    half = np.array([SCENARIOS[name]["demi_saturation"] for name in names])[:, None]
+    lifts = lift_max * budgets / (budgets + half)
+    totals = baseline.sum() + (profiles @ baseline)[:, None] * lifts
+    return pd.DataFrame(totals.T, index=pd.Index(budgets, name="budget"), columns=names)
+
+
+def save_predictions(dataset_id, forecast: pd.DataFrame, version, horizon_days):
+    """Écrit la prévision dans `predictions`, en remplaçant celle du même modèle et horizon."""
+    if forecast.empty:
+        return
+    rows = [
+        (
+            dataset_id,
+            day.date(),
+            "quantite",
+            round(float(value), 2),
+            FORECAST_INTERVAL_WIDTH * 100,
+            None if pd.isna(zone) else str(zone)[:50],
+            str(produit)[:100],
+            version,
+            horizon_days,
+        )
+        for produit, zone, day, value in forecast[["produit", "zone", "date", "yhat"]].itertuples(index=False, name=None)
+    ]
+    connection = cursor = None
+    try:
+        connection = _get_connection()
+        cursor = connection.cursor()
+        cursor.execute(
+            "DELETE FROM predictions WHERE dataset_id = %s AND version_modele = %s AND horizon_jours = %s",
+            (dataset_id, version, horizon_days),
+        )
+        cursor.executemany(
+            "INSERT INTO predictions (dataset_id, date_cible, type_prediction, valeur_predite, "
+            "intervalle_confiance, zone, produit, version_modele, horizon_jours) "
+            "VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)",
+            rows,
+        )
+        connection.commit()
+    finally:
+        _release_connection(connection, cursor)
+
+
+def load_predictions(dataset_id, version, horizon_days):
+    """Relit une prévision enregistrée dans `predictions` ; None si elle n'existe pas."""
+    forecast = _run_query(
+        "SELECT produit, zone, date_cible AS date, valeur_predite AS yhat FROM predictions "
+        "WHERE dataset_id = %s AND version_modele = %s AND horizon_jours = %s",
+        (dataset_id, version, horizon_days),
+    )
+    if forecast.empty:
+        return None
+    forecast["date"] = pd.to_datetime(forecast["date"])
+    forecast["yhat"] = pd.to_numeric(forecast["yhat"])
+    return forecast
+
+
+def compute_baseline_forecast(engine, dataset_key, raw, horizon_days, reuse_after=0.0, on_progress=None, lineage=None):
+    """Prévision de base (sans effet scénario), historique des 28 derniers jours et stats d'entraînement."""
+    series = forecast_series(raw)
+    stats = None
+    if engine == "xgboost":
+        forecast, stats = run_global_forecast(lineage or dataset_key, series, horizon_days)
+    else:
+        forecast = run_forecast(dataset_key, series, horizon_days, reuse_after=reuse_after, on_progress=on_progress)
+    history = series.groupby("ds")["y"].sum()
+    recent = history[history.index > history.index.max() - pd.Timedelta(days=28)]
+    return forecast, recent, stats
+
+
+@st.cache_resource
+def _forecast_cache():
+    return _LRUCache(FORECAST_CACHE_SIZE)
+
+
+def _forecast_entry(forecast, recent, scenario, horizon_days):
+    return {
+        "forecast": forecast,
+        "baseline": forecast.groupby("date")["yhat"].sum(),
+        "recent": recent,
+        "profile": scenario_profile(scenario, horizon_days),
+    }
+
+
+def cache_forecast(dataset_key, dataset_id, engine, horizon_days, forecast, recent):
+    """Range une prévision de base en cache pour tous les scénarios et la persiste dans `predictions`."""
+    version = ENGINE_VERSIONS[engine]
+    cache = _forecast_cache()
+    for scenario in SCENARIOS:
+        cache.put((dataset_key, version, horizon_days, scenario), _forecast_entry(forecast, recent, scenario, horizon_days))
+    if dataset_id is not None:
+        save_predictions(dataset_id, forecast, version, horizon_days)
+
+
+def cached_forecast(dataset_key, dataset_id, engine, horizon_days, scenario):
+    """Prévision depuis le cache LRU, sinon depuis `predictions` ; None si elle reste à calculer."""
+    version = ENGINE_VERSIONS[engine]
+    key = (dataset_key, version, horizon_days, scenario)
+    cache = _forecast_cache()
+    entry = cache.get(key)
+    if entry is None and dataset_id is not None:
+        try:
+            forecast = load_predictions(dataset_id, version, horizon_days)
+        except Error:
+            forecast = None
+        if forecast is not None:
+            entry = _forecast_entry(forecast, None, scenario, horizon_days)
+            cache.put(key, entry)
+    return entry
+
+
+@st.cache_resource
+def _forecast_locks():
+    return {"guard": threading.Lock(), "locks": {}}
+
+
+def forecast_lock(key) -> threading.Lock:
+    """Verrou partagé par toutes les sessions pour `key` (dataset, moteur et horizon, ou fichier de modèle)."""
+    locks = _forecast_locks()
+    with locks["guard"]:
+        return locks["locks"].setdefault(key, threading.Lock())
+
+
+@st.cache_resource
+def _forecast_scheduler():
+    return {
+        "executor": ThreadPoolExecutor(max_workers=1, thread_name_prefix="forecast-precompute"),
+        "pending": set(),
+        "lock": threading.Lock(),
+    }
+
+
+def schedule_forecast_precompute(dataset_key, dataset_id, load_raw, lineage=None, engine=PRECOMPUTE_ENGINE):
+    """Précalcule en arrière-plan les trois horizons d'un dataset pour que la page réponde depuis le cache."""
+    scheduler = _forecast_scheduler()
+    job_key = (dataset_key, engine)
+
+    def job():
+        try:
+            raw = None
+            for horizon_days in FORECAST_HORIZONS.values():
+                with forecast_lock((dataset_key, engine, horizon_days)):
+                    if cached_forecast(dataset_key, dataset_id, engine, horizon_days, next(iter(SCENARIOS))) is not None:
+                        continue
+                    raw = load_raw() if raw is None else raw
+                    forecast, recent, _ = compute_baseline_forecast(engine, dataset_key, raw, horizon_days, lineage=lineage)
+                    cache_forecast(dataset_key, dataset_id, engine, horizon_days, forecast, recent)
+        except Exception:
+            # La page calculera la prévision à la demande.
+            logging.getLogger(__name__).exception("Échec du précalcul des prévisions pour %s", dataset_key)
+        finally:
+            with scheduler["lock"]:
+                scheduler["pending"].discard(job_key)
+
+    with scheduler["lock"]:
+        if job_key in scheduler["pending"]:
+            return
+        scheduler["pending"].add(job_key)
+    scheduler["executor"].submit(job)
@@ -0,0 +1,54 @@
+import io
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+
+@pytest.fixture
+def csv_upload():
+    """Fabrique un fichier téléversé (CSV) à partir d'un DataFrame."""
+
+    def make(frame, name="ventes.csv"):
+        upload = io.BytesIO(frame.to_csv(index=False).encode("utf-8"))
+        upload.name = name
+        upload.size = len(upload.getvalue())
+        return upload
+
+    return make
+
+
+@pytest.fixture
+def ventes_sql(monkeypatch):
+    """Table `ventes` en SQLite servie à la place de MySQL par `_run_query`."""
+    import sqlite3
+
+    import pandas as pd
+
+    import sales_engine
+
+    connection = sqlite3.connect(":memory:")
+    connection.create_function("DATE_FORMAT", 2, lambda value, fmt: pd.Timestamp(value).strftime(fmt))
+
+    def run_query(query, params=()):
+        cursor = connection.execute(query.replace("%s", "?"), tuple(params))
+        return pd.DataFrame.from_records(cursor.fetchall(), columns=[c[0] for c in cursor.description])
+
+    def load(frame, dataset_id=1):
+        rows = frame.reindex(columns=sales_engine.VENTES_COLUMNS).assign(dataset_id=dataset_id)
+        rows["date_vente"] = pd.to_datetime(rows["date_vente"]).dt.strftime("%Y-%m-%d")
+        rows.astype(object).where(rows.notna(), None).to_sql("ventes", connection, if_exists="append", index=False)
+        return dataset_id
+
+    monkeypatch.setattr(sales_engine, "_run_query", run_query)
+    for query in (
+        sales_engine.query_product_report,
+        sales_engine.query_analytics_plan,
+        sales_engine.query_dashboard_rollup,
+        sales_engine.query_top_products,
+    ):
+        query.clear()
+    yield load
+    connection.close()
@@ -0,0 +1,41 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from sales_engine import query_dashboard_rollup, query_top_products
+
+
+@pytest.fixture
+def ventes():
+    rng = np.random.default_rng(3)
+    n = 500
+    return pd.DataFrame(
+        {
+            "date_vente": pd.Timestamp("2024-01-01") + pd.to_timedelta(rng.integers(0, 60, n), unit="D"),
+            "produit": rng.choice([f"p{i}" for i in range(12)], n),
+            "zone": rng.choice(["Conakry", "Kindia", "Labé"], n),
+            "quantite": rng.integers(1, 10, n),
+            "prix_unitaire": rng.integers(500, 5_000, n).astype(float),
+        }
+    )
+
+
+def test_rollup_is_aggregated_by_day_and_zone(ventes_sql, ventes):
+    dataset_id = ventes_sql(ventes)
+
+    rollup = query_dashboard_rollup(dataset_id, "2024-01-10", "2024-02-10")
+
+    period = ventes[ventes["date_vente"].between("2024-01-10", "2024-02-10")]
+    assert len(rollup["cube"]) == period.groupby(["date_vente", "zone"]).ngroups
+    assert rollup["n_rows"] == len(period)
+    assert rollup["cube"]["chiffre_affaires"].sum() == pytest.approx((period["quantite"] * period["prix_unitaire"]).sum())
+
+
+def test_top_products_limited_by_sql(ventes_sql, ventes):
+    dataset_id = ventes_sql(ventes)
+
+    top = query_top_products(dataset_id, 5)
+
+    expected = (ventes["quantite"] * ventes["prix_unitaire"]).groupby(ventes["produit"]).sum().nlargest(5)
+    assert top.index.tolist() == expected.index.tolist()
+    np.testing.assert_allclose(top.to_numpy(), expected.to_numpy())
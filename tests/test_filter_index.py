@@ -0,0 +1,51 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from sales_engine import FilterIndex
+
+
+@pytest.fixture
+def ventes():
+    rng = np.random.default_rng(7)
+    n = 2_000
+    return pd.DataFrame(
+        {
+            "date": pd.Timestamp("2024-01-01") + pd.to_timedelta(rng.integers(0, 120, n), unit="D"),
+            "categorie": pd.Categorical(rng.choice(["Boissons", "Épicerie", None], n)),
+            "produit": rng.choice(["riz", "huile", "sucre", "lait", "café"], n),
+            "quantite": rng.integers(1, 10, n),
+        }
+    )
+
+
+@pytest.mark.parametrize(
+    "filters",
+    [
+        {},
+        {"start": "2024-02-01", "end": "2024-02-29"},
+        {"categorie": "Boissons"},
+        {"produits": ["riz", "lait"]},
+        {"start": "2024-01-15", "end": "2024-03-15", "categorie": "Épicerie", "produits": ["huile", "inconnu"]},
+    ],
+)
+def test_apply_matches_pandas_masks(ventes, filters):
+    expected = pd.Series(True, index=ventes.index)
+    if "start" in filters:
+        expected &= ventes["date"].between(pd.Timestamp(filters["start"]), pd.Timestamp(filters["end"]))
+    if "categorie" in filters:
+        expected &= ventes["categorie"] == filters["categorie"]
+    if "produits" in filters:
+        expected &= ventes["produit"].isin(filters["produits"])
+
+    result = FilterIndex(ventes).apply(ventes, **filters)
+
+    pd.testing.assert_frame_equal(result, ventes[expected])
+
+
+def test_options_restricted_to_category(ventes):
+    index = FilterIndex(ventes)
+    expected = sorted(ventes.loc[ventes["categorie"] == "Boissons", "produit"].unique())
+
+    assert index.options("produit", "Boissons") == expected
+    assert index.options("categorie") == ["Boissons", "Épicerie"]
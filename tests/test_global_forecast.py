@@ -0,0 +1,82 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+import pytest
+from mysql.connector import Error
+
+import sales_engine
+from sales_engine import dataset_lineage, run_global_forecast, schedule_forecast_precompute
+
+
+@pytest.fixture(autouse=True)
+def offline(monkeypatch, tmp_path):
+    def no_database(*args, **kwargs):
+        raise Error("base hors ligne")
+
+    monkeypatch.setattr(sales_engine, "_run_query", no_database)
+    monkeypatch.setattr(sales_engine, "MODEL_STORE_DIR", tmp_path)
+    monkeypatch.setattr(sales_engine, "GLOBAL_TREES", 20)
+    monkeypatch.setattr(sales_engine, "GLOBAL_INCREMENTAL_TREES", 5)
+
+
+def daily_series(n_days, seed=0):
+    rng = np.random.default_rng(seed)
+    days = pd.date_range("2024-01-01", periods=n_days, freq="D")
+    frames = [
+        pd.DataFrame({"produit": produit, "zone": "Conakry", "ds": days, "y": rng.poisson(5, n_days).astype(float)})
+        for produit in ("riz", "huile")
+    ]
+    return pd.concat(frames, ignore_index=True)
+
+
+def test_grown_dataset_is_trained_incrementally():
+    lineage = dataset_lineage("a@b.gn", "ventes_20240301_101500")
+    history = daily_series(90)
+
+    _, first = run_global_forecast(lineage, history[history["ds"] < "2024-03-01"], 7)
+    _, grown = run_global_forecast(lineage, history, 7)
+    _, again = run_global_forecast(lineage, history, 7)
+
+    assert first["mode"] == "complet"
+    assert grown["mode"] == "incrémental"
+    assert grown["train_rows"] == 2 * (90 - 60)
+    assert again["mode"] == "réutilisé"
+
+
+def test_rewritten_history_is_retrained_from_scratch():
+    lineage = dataset_lineage("a@b.gn", "ventes_20240301_101500")
+    run_global_forecast(lineage, daily_series(60), 7)
+
+    _, stats = run_global_forecast(lineage, daily_series(70, seed=1), 7)
+
+    assert stats["mode"] == "complet"
+
+
+def test_lineage_ignores_upload_timestamp():
+    assert dataset_lineage("a@b.gn", "ventes_20240301_101500") == dataset_lineage("a@b.gn", "ventes_20240415_083000")
+    assert dataset_lineage("a@b.gn", "ventes_20240301_101500") != dataset_lineage("c@d.gn", "ventes_20240301_101500")
+
+
+def test_concurrent_requests_train_the_model_once():
+    lineage = dataset_lineage("a@b.gn", "ventes_20240301_101500")
+    history = daily_series(60)
+
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        modes = sorted(stats["mode"] for _, stats in pool.map(lambda h: run_global_forecast(lineage, history, h), (7, 30)))
+
+    assert modes == ["complet", "réutilisé"]
+    assert [p.name for p in sales_engine._global_model_path(lineage).parent.iterdir()] == ["global_xgb.joblib"]
+
+
+def test_precompute_failures_are_logged(caplog):
+    def broken_loader():
+        raise RuntimeError("Parquet illisible")
+
+    with caplog.at_level(logging.ERROR, logger="sales_engine"):
+        schedule_forecast_precompute("session-test", None, broken_loader, "lineage-test")
+        sales_engine._forecast_scheduler()["executor"].submit(lambda: None).result()
+
+    assert "session-test" in caplog.text
+    assert "Parquet illisible" in caplog.text
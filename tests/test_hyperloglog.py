@@ -0,0 +1,28 @@
+import numpy as np
+import pandas as pd
+
+from sales_engine import HyperLogLog
+
+
+def test_count_within_standard_error():
+    values = pd.Series(np.arange(100_000)).astype(str)
+    sketch = HyperLogLog()
+    sketch.add(values)
+
+    assert abs(sketch.count() - 100_000) / 100_000 < 0.05
+
+
+def test_small_cardinality_is_exact_enough():
+    sketch = HyperLogLog()
+    sketch.add(pd.Series(["a", "b", "c", "a", None]))
+
+    assert sketch.count() == 3
+
+
+def test_merge_counts_union_once():
+    left, right = HyperLogLog(), HyperLogLog()
+    left.add(pd.Series(np.arange(0, 30_000)))
+    right.add(pd.Series(np.arange(20_000, 50_000)))
+    left.merge(right)
+
+    assert abs(left.count() - 50_000) / 50_000 < 0.05
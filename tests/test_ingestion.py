@@ -0,0 +1,63 @@
+import io
+
+import numpy as np
+import pandas as pd
+import pytest
+from openpyxl import Workbook
+
+from sales_engine import ingest_uploaded_file
+
+
+def test_numeric_column_widened_to_text_keeps_values(csv_upload, tmp_path):
+    codes = [str(i) for i in range(10)] + ["A-12", "B-7"]
+    frame = pd.DataFrame({"code": codes, "quantite": range(12)})
+
+    data = ingest_uploaded_file(csv_upload(frame), chunk_rows=5, store_path=tmp_path / "ventes.parquet")
+
+    assert len(data) == 12
+    assert data["code"].astype(str).tolist() == codes
+    assert data["quantite"].tolist() == list(range(12))
+
+
+def test_empty_column_takes_type_of_later_chunk(csv_upload, tmp_path):
+    remise = [None] * 6 + [1.5, 2.0, 2.5, 3.0]
+    frame = pd.DataFrame({"produit": list("abcdefghij"), "remise": remise})
+
+    data = ingest_uploaded_file(csv_upload(frame), chunk_rows=3, store_path=tmp_path / "ventes.parquet")
+
+    assert pd.api.types.is_numeric_dtype(data["remise"])
+    assert data["remise"].isna().sum() == 6
+    assert data["remise"].iloc[6:].tolist() == [1.5, 2.0, 2.5, 3.0]
+
+
+def test_date_column_widened_when_later_chunk_is_not_a_date(csv_upload, tmp_path):
+    dates = ["2024-01-01", "2024-01-02", "2024-01-03", "inconnue"]
+    frame = pd.DataFrame({"date": dates, "quantite": [1, 2, 3, 4]})
+
+    data = ingest_uploaded_file(csv_upload(frame), chunk_rows=2, store_path=tmp_path / "ventes.parquet")
+
+    assert data["date"].astype(str).tolist() == dates
+
+
+def test_dates_parsed_once_at_ingestion(csv_upload, tmp_path):
+    frame = pd.DataFrame({"date": pd.date_range("2024-01-01", periods=8).strftime("%Y-%m-%d"), "quantite": np.arange(8)})
+
+    data = ingest_uploaded_file(csv_upload(frame), chunk_rows=3, store_path=tmp_path / "ventes.parquet")
+
+    assert pd.api.types.is_datetime64_any_dtype(data["date"])
+    assert data["date"].iloc[-1] == pd.Timestamp("2024-01-08")
+
+
+@pytest.mark.parametrize("name", ["ventes.csv", "ventes.xlsx"])
+def test_header_only_upload_is_rejected(name, tmp_path):
+    if name.endswith(".xlsx"):
+        workbook = Workbook()
+        workbook.active.append(["date", "produit", "quantite"])
+        upload = io.BytesIO()
+        workbook.save(upload)
+    else:
+        upload = io.BytesIO(b"date,produit,quantite\n")
+    upload.name, upload.size = name, len(upload.getvalue())
+
+    with pytest.raises(ValueError, match="aucune ligne"):
+        ingest_uploaded_file(upload, store_path=tmp_path / "ventes.parquet")
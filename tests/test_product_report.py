@@ -0,0 +1,103 @@
+import pandas as pd
+
+from sales_engine import build_analytics_plan, build_product_report, query_analytics_plan, query_product_report
+
+
+def test_margins_per_product():
+    ventes = pd.DataFrame(
+        {
+            "produit": ["riz", "riz", "huile"],
+            "quantite": pd.array([2, 3, 4], dtype="int8"),
+            "prix_unitaire": pd.array([1_000, 1_200, 2_500], dtype="float32"),
+            "cout_unitaire": [600.0, 700.0, 2_000.0],
+            "stock": [10, 5, 8],
+        }
+    )
+
+    report = build_product_report(ventes).set_index("Produit")
+
+    assert report.loc["riz", "CA_Total"] == 2 * 1_000 + 3 * 1_200
+    assert report.loc["riz", "Marge_Totale"] == 2 * 400 + 3 * 500
+    assert report.loc["huile", "Marge_Totale"] == 4 * 500
+    assert report.loc["riz", "Stock_Actuel"] == 15
+
+
+def test_missing_values_count_as_zero():
+    ventes = pd.DataFrame(
+        {
+            "produit": ["riz", "riz", "huile"],
+            "quantite": [2.0, None, 4.0],
+            "prix_unitaire": [1_000.0, 1_200.0, 2_500.0],
+            "cout_unitaire": [None, 700.0, 2_000.0],
+            "stock": [10, None, 8],
+        }
+    )
+
+    report = build_product_report(ventes).set_index("Produit")
+
+    assert report.loc["riz", "Ventes_Totales"] == 2
+    assert report.loc["riz", "CA_Total"] == 2_000
+    assert report.loc["riz", "Marge_Totale"] == 2_000
+    assert report.loc["riz", "Stock_Actuel"] == 10
+
+
+def test_session_and_sql_reports_agree(ventes_sql):
+    ventes = pd.DataFrame(
+        {
+            "date_vente": pd.date_range("2024-03-01", periods=6),
+            "produit": ["riz", "riz", "huile", "huile", "sucre", "sucre"],
+            "categorie": ["Épicerie"] * 6,
+            "zone": ["Conakry"] * 6,
+            "quantite": [2, 3, None, 4, 1, 5],
+            "prix_unitaire": [1_000.0, 1_200.0, 2_500.0, None, 800.0, 750.0],
+            "cout_unitaire": [600.0, None, 2_000.0, 1_900.0, 500.0, 450.0],
+            "stock": [10, 5, None, 8, 3, 2],
+        }
+    )
+    dataset_id = ventes_sql(ventes)
+
+    session = build_product_report(ventes).drop(columns="Date_Export")
+    mysql = query_product_report(dataset_id, "Rapport complet").drop(columns="Date_Export")
+
+    pd.testing.assert_frame_equal(session, mysql, check_dtype=False)
+
+
+def test_margin_unknown_without_costs(ventes_sql):
+    ventes = pd.DataFrame(
+        {
+            "date_vente": pd.date_range("2024-03-01", periods=4),
+            "produit": ["riz", "riz", "huile", "huile"],
+            "quantite": [2, 3, 1, 4],
+            "prix_unitaire": [1_000.0, 1_200.0, 2_500.0, 2_400.0],
+            "cout_unitaire": [600.0, None, None, None],
+        }
+    )
+    dataset_id = ventes_sql(ventes)
+
+    session = build_product_report(ventes).set_index("Produit")
+    mysql = query_product_report(dataset_id, "Rapport complet").set_index("Produit")
+
+    assert session.loc["riz", "Marge_Totale"] == mysql.loc["riz", "Marge_Totale"] == 2 * 400 + 3 * 1_200
+    assert pd.isna(session.loc["huile", "Marge_Totale"])
+    assert pd.isna(mysql.loc["huile", "Marge_Totale"])
+
+
+def test_analytics_margin_hidden_without_cost_data(ventes_sql):
+    ventes = pd.DataFrame(
+        {
+            "date_vente": pd.date_range("2024-03-01", periods=4),
+            "produit": ["riz", "riz", "huile", "huile"],
+            "quantite": [2, 3, 1, 4],
+            "prix_unitaire": [1_000.0, 1_200.0, 2_500.0, 2_400.0],
+            "cout_unitaire": [float("nan")] * 4,
+        }
+    )
+    dataset_id = ventes_sql(ventes)
+
+    session = build_analytics_plan(ventes.rename(columns={"date_vente": "date"}))
+    mysql = query_analytics_plan(dataset_id)
+
+    for plan in (session, mysql):
+        assert "marge" not in plan["metrics"]
+        assert "marge" not in plan["by_product"].columns
+        assert plan["metrics"]["ca"] == 2 * 1_000 + 3 * 1_200 + 2_500 + 4 * 2_400
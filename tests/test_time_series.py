@@ -0,0 +1,52 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import sales_engine
+from sales_engine import compute_time_series
+
+
+@pytest.fixture
+def ventes():
+    rng = np.random.default_rng(11)
+    n = 3_000
+    return pd.DataFrame(
+        {
+            "date": pd.Timestamp("2024-01-01") + pd.to_timedelta(np.sort(rng.integers(0, 120, n)), unit="D"),
+            "chiffre_affaires": rng.integers(1_000, 9_000, n).astype("int32"),
+        }
+    )
+
+
+def expected_series(frame, freq):
+    return compute_time_series(frame, "date", "chiffre_affaires", freq=freq)
+
+
+def test_grown_dataset_appends_only_new_rows(ventes, monkeypatch):
+    sales_engine._time_series_cache().clear()
+    appended = []
+    original = sales_engine.TimeSeriesIndex.append
+    monkeypatch.setattr(
+        sales_engine.TimeSeriesIndex, "append", lambda self, df: appended.append(len(df)) or original(self, df)
+    )
+    first = ventes.iloc[:2_000]
+    # Le dataset agrandi est recompacté : la mesure peut changer de type sans que ses valeurs changent.
+    grown = ventes.astype({"chiffre_affaires": "int64"})
+
+    compute_time_series(first, "date", "chiffre_affaires", dataset_key="v1", lineage="lineage-ventes")
+    result = compute_time_series(grown, "date", "chiffre_affaires", freq="W", dataset_key="v2", lineage="lineage-ventes")
+
+    assert appended == [2_000, 1_000]
+    monkeypatch.undo()
+    pd.testing.assert_frame_equal(result, expected_series(ventes, "W"), check_dtype=False)
+
+
+def test_rewritten_rows_rebuild_the_index(ventes):
+    sales_engine._time_series_cache().clear()
+    corrected = ventes.copy()
+    corrected.loc[10, "chiffre_affaires"] = 0
+
+    compute_time_series(ventes.iloc[:2_000], "date", "chiffre_affaires", dataset_key="v1", lineage="lineage-ventes")
+    result = compute_time_series(corrected, "date", "chiffre_affaires", dataset_key="v2", lineage="lineage-ventes")
+
+    pd.testing.assert_frame_equal(result, expected_series(corrected, "D"), check_dtype=False)